@@ -0,0 +1,184 @@
+"""Fast serialization of read-only event previews
+
+Preview serializers are flat and read-only, yet DRF builds every row field by field: attribute lookup,
+to_representation and an OrderedDict per object. compile_serializer turns such serializer class into a list of
+.values() lookups and per-field builders once, then pages are built as plain dicts straight from values rows.
+Image URLs are built once per file name of a page. Output is the same as of the serializer itself, serializers
+with fields which can't be read from values rows (method fields, many relations) are not compiled and keep
+going through DRF.
+"""
+
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.relations import (ManyRelatedField,
+                                      PrimaryKeyRelatedField, RelatedField)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from events.api.fields import storage_url
+
+# fields computed from objects, not from values of model fields
+UNSUPPORTED_FIELDS = (serializers.SerializerMethodField, serializers.HiddenField, serializers.ListField,
+                      serializers.DictField, serializers.ListSerializer, ManyRelatedField)
+
+INTEGER_FIELD_TYPES = ('AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField', 'SmallIntegerField',
+                       'PositiveIntegerField', 'PositiveSmallIntegerField')
+TEXT_FIELD_TYPES = ('CharField', 'TextField', 'SlugField', 'EmailField', 'URLField')
+
+# (values row, page state) -> representation of field
+Builder = Callable[[dict, '_PageState'], object]
+
+
+class NotCompilable(Exception):
+    """Serializer has fields which can't be built from values rows"""
+
+
+class _PageState:
+    """Things shared by rows of one serialized page"""
+
+    def __init__(self, context: dict):
+        self.request = context.get('request')
+        self.urls = {}
+
+    def file_url(self, storage, name: str) -> str:
+        """Same as FileField of DRF makes of file, built once per file of page"""
+        key = (storage, name)
+        if key not in self.urls:
+            url = storage_url(storage, name)
+            self.urls[key] = self.request.build_absolute_uri(url) if self.request is not None else url
+        return self.urls[key]
+
+
+def _model_field(model, source_attrs: List[str]):
+    """Model field at the end of source path, following foreign keys"""
+    field = None
+    for attr in source_attrs:
+        if field is not None:
+            if not (field.many_to_one or field.one_to_one):
+                raise NotCompilable(f'{attr} is read through {field.name} relation')
+            model = field.related_model
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            raise NotCompilable(f'{attr} is not a field of {model.__name__}')
+        if not field.concrete:
+            raise NotCompilable(f'{attr} of {model.__name__} is not stored in its table')
+    return field
+
+
+def _returns_value_as_is(field: serializers.Field, model_field) -> bool:
+    """Field would represent value of model field unchanged"""
+    field_type, model_type = type(field), model_field.get_internal_type()
+    if field_type is serializers.ReadOnlyField:
+        return True
+    if field_type is serializers.ChoiceField:
+        return all(isinstance(key, str) for key in field.choices)
+    if field_type is serializers.CharField:
+        return model_type in TEXT_FIELD_TYPES
+    if field_type is serializers.IntegerField:
+        return model_type in INTEGER_FIELD_TYPES
+    if field_type is serializers.BooleanField:
+        return model_type == 'BooleanField'
+    return False
+
+
+def _compile_field(field: serializers.Field, model, prefix: str) -> Tuple[List[str], Builder]:
+    if isinstance(field, UNSUPPORTED_FIELDS):
+        raise NotCompilable(f'{field.field_name} is {type(field).__name__}')
+
+    if isinstance(field, serializers.BaseSerializer):
+        if field.source == '*':
+            return _compile_serializer(field, prefix)
+        relation = _model_field(model, field.source_attrs)
+        if not (relation.many_to_one or relation.one_to_one):
+            raise NotCompilable(f'{field.field_name} is not a foreign key')
+        if getattr(getattr(field, 'Meta', None), 'model', None) is not relation.related_model:
+            raise NotCompilable(f'{field.field_name} is not serialized as {relation.related_model.__name__}')
+        lookup = prefix + '__'.join(field.source_attrs)
+        lookups, build_nested = _compile_serializer(field, f'{lookup}__')
+        return [lookup, *lookups], lambda row, state: None if row[lookup] is None else build_nested(row, state)
+
+    if field.source == '*':
+        raise NotCompilable(f'{field.field_name} is built of whole object')
+    model_field = _model_field(model, field.source_attrs)
+    lookup = prefix + '__'.join(field.source_attrs)
+
+    if isinstance(field, RelatedField):
+        if not isinstance(field, PrimaryKeyRelatedField) or field.pk_field is not None or not model_field.is_relation:
+            raise NotCompilable(f'{field.field_name} is {type(field).__name__}')
+        # values of foreign key lookup are primary keys already
+        return [lookup], lambda row, state: row[lookup]
+    if model_field.is_relation:
+        raise NotCompilable(f'{field.field_name} represents related object')
+
+    if isinstance(field, serializers.FileField):
+        storage = model_field.storage
+        if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return [lookup], lambda row, state: row[lookup] or None
+        return [lookup], lambda row, state: state.file_url(storage, row[lookup]) if row[lookup] else None
+
+    if _returns_value_as_is(field, model_field):
+        return [lookup], lambda row, state: row[lookup]
+    to_representation = field.to_representation
+    return [lookup], lambda row, state: None if row[lookup] is None else to_representation(row[lookup])
+
+
+def _compile_serializer(serializer: serializers.BaseSerializer, prefix: str = '') -> Tuple[List[str], Builder]:
+    serializer_class = type(serializer)
+    if serializer_class.to_representation is not serializers.Serializer.to_representation:
+        raise NotCompilable(f'{serializer_class.__name__} has own to_representation')
+    model = getattr(getattr(serializer_class, 'Meta', None), 'model', None)
+    if model is None:
+        raise NotCompilable(f'{serializer_class.__name__} is not a model serializer')
+
+    lookups, builders = [], []
+    for field in serializer._readable_fields:
+        field_lookups, build_field = _compile_field(field, model, prefix)
+        lookups.extend(lookup for lookup in field_lookups if lookup not in lookups)
+        builders.append((field.field_name, build_field))
+
+    return lookups, lambda row, state: {name: build_field(row, state) for name, build_field in builders}
+
+
+class CompiledSerializer:
+    """Read-only serializer class compiled to build representations from values rows"""
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.lookups, self._build = _compile_serializer(serializer_class())
+
+    def values(self, queryset):
+        """Values queryset with everything the representation is built of"""
+        return queryset.values(*self.lookups)
+
+    def serialize(self, rows: Iterable[dict], context: dict) -> List[dict]:
+        state = _PageState(context)
+        return [self._build(row, state) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class) -> Optional[CompiledSerializer]:
+    """Compiled serializer class, None if it has fields which can't be built from values rows"""
+    try:
+        return CompiledSerializer(serializer_class)
+    except NotCompilable:
+        return None
+
+
+class CompiledListMixin:
+    """List action of generic view which serializes page from values rows when its serializer compiles"""
+
+    def list(self, request, *args, **kwargs):
+        compiled = compile_serializer(self.get_serializer_class())
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        data = compiled.serialize(page if page is not None else rows, self.get_serializer_context())
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
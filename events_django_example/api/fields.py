@@ -0,0 +1,52 @@
+"""Serializer fields of event app
+
+Storage URL of a file is built from its name only, but remote storages make it with signing or other work
+per call. Image fields here keep built URLs in a short-lived per-process cache, so lists showing the same
+images again and again don't rebuild them.
+"""
+
+import time
+
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+# seconds built URLs are kept, must be well below lifetime of signed URLs
+DEFAULT_URL_TTL = 60 * 5
+# cache is dropped at once when it grows over this number of URLs
+URL_CACHE_MAX_SIZE = 20000
+
+# (storage, file name) -> (URL, expiration time), shared by threads of process
+_urls = {}
+
+
+def storage_url(storage, name: str) -> str:
+    """URL of file in storage, built once per DEFAULT_URL_TTL"""
+    now = time.monotonic()
+    url, expires = _urls.get((storage, name), (None, 0))
+    if expires <= now:
+        url = storage.url(name)
+        if len(_urls) >= URL_CACHE_MAX_SIZE:
+            _urls.clear()
+        _urls[(storage, name)] = (url, now + getattr(settings, 'EVENT_IMAGE_URL_TTL', DEFAULT_URL_TTL))
+    return url
+
+
+def clear_url_cache() -> None:
+    _urls.clear()
+
+
+class CachedImageField(serializers.ImageField):
+    """ImageField of DRF which takes storage URLs from cache"""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        if not getattr(self, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return value.name
+
+        url = storage_url(value.storage, value.name)
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
@@ -0,0 +1,81 @@
+"""Querysets planned by serializer fields
+
+Nested serializers read related objects one by one, which is one query per object unless the queryset joins
+or prefetches them. plan_queryset walks readable fields of a serializer class and applies select_related for
+nested foreign keys and prefetch_related for nested lists, so querysets follow serializers as they change.
+"""
+
+from functools import lru_cache
+from typing import List, Tuple
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def _relation(model, source_attrs: List[str]):
+    """Relation at the end of source path, None if path is not made of relations"""
+    field = None
+    for attr in source_attrs:
+        if field is not None:
+            model = field.related_model
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        if not field.is_relation:
+            return None
+    return field
+
+
+def _walk(serializer: serializers.BaseSerializer, model, prefix: str, in_prefetch: bool,
+          select: List[str], prefetch: List[str]) -> None:
+    for field in serializer._readable_fields:
+        many = isinstance(field, serializers.ListSerializer)
+        nested = field.child if many else field
+        if not isinstance(nested, serializers.BaseSerializer):
+            continue
+        if field.source == '*':
+            _walk(nested, model, prefix, in_prefetch, select, prefetch)
+            continue
+
+        relation = _relation(model, field.source_attrs)
+        if relation is None:
+            # property or method of object, it loads what it needs itself
+            continue
+        lookup = prefix + '__'.join(field.source_attrs)
+        single = relation.many_to_one or relation.one_to_one
+        if single and not many and not in_prefetch:
+            select.append(lookup)
+        else:
+            prefetch.append(lookup)
+        _walk(nested, relation.related_model, f'{lookup}__', in_prefetch or not single, select, prefetch)
+
+
+@lru_cache(maxsize=None)
+def related_lookups(serializer_class) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """select_related and prefetch_related lookups which serializer class needs"""
+    select, prefetch = [], []
+    _walk(serializer_class(), serializer_class.Meta.model, '', False, select, prefetch)
+    return tuple(select), tuple(prefetch)
+
+
+def plan_queryset(queryset, serializer_class):
+    """Queryset which loads all related objects serializer class shows with a fixed number of queries"""
+    select, prefetch = related_lookups(serializer_class)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+class PlannedQuerysetMixin:
+    """Generic view which loads related objects of its serializer, get_queryset passes its result to plan"""
+    # viewset actions which serialize their queryset, other actions only look objects up or write them
+    planned_actions = ('list', 'retrieve')
+
+    def plan_queryset(self, queryset):
+        action = getattr(self, 'action', None)
+        if action is not None and action not in self.planned_actions:
+            return queryset
+        return plan_queryset(queryset, self.get_serializer_class())
@@ -1,15 +1,17 @@
 """Serializers for event app"""
 
 from django.contrib.auth import get_user_model
+from django.db import models
 from django.utils import timezone
 from drf_yasg.utils import swagger_serializer_method
 from rest_framework import serializers
 
 from campaigns.models import Campaign
+from events import counters, friend_counts, previews, viewer_context
+from events.api.fields import CachedImageField
 from events.models import (Attendance, Event, EventCategory,
                            EventCategoryImage, EventComment, EventImage,
                            EventInvite, EventLike, Reminder)
-from prism.utils.cache_utils import get_count_of
 from prism.utils.doc_utils import EventCountersSwaggerSerializer
 from prism.utils.drf_utils import check_if_request
 from system.timezones import TIMEZONES
@@ -20,7 +22,15 @@ TIMEZONES_CHOICES = [(tz, tz) for tz in TIMEZONES]
 User = get_user_model()
 
 
-class EventImageSerializer(serializers.HyperlinkedModelSerializer):
+class CachedImagesModelSerializer(serializers.ModelSerializer):
+    """ModelSerializer which builds image fields of model as CachedImageField"""
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: CachedImageField,
+    }
+
+
+class EventImageSerializer(CachedImagesModelSerializer):
     """EventImageSerializer class"""
     class Meta:
         """EventImageSerializer metaclass"""
@@ -45,14 +55,20 @@ class AttendancePreviewSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class EventViewerContextListSerializer(serializers.ListSerializer):
+    """Load viewer's relations to all events at once, before they are serialized one by one"""
+
+    def to_representation(self, data):
+        events = list(data.all() if hasattr(data, 'all') else data)
+        viewer_context.install(self.context, events)
+        return super().to_representation(events)
+
+
 class EventViewerAttendanceStatusSerializerMixin(serializers.Serializer):
     viewer_attendance_status = serializers.SerializerMethodField()
 
     def get_viewer_attendance_status(self, obj) -> int:
-        try:
-            return Attendance.objects.get(event=obj, user=self.context['request'].user).status
-        except Attendance.DoesNotExist:
-            pass
+        return viewer_context.for_event(self.context, obj).attendance_status(obj.pk)
 
 
 class EventLikedByViewerSerializerMixin(serializers.Serializer):
@@ -61,13 +77,57 @@ class EventLikedByViewerSerializerMixin(serializers.Serializer):
     @check_if_request
     def get_liked_by_viewer(self, obj) -> bool:
         """Check if viewer liked this event"""
-        try:
-            return obj.likes.filter(user_id=self.context["request"].user.id).exists()
-        except EventLike.DoesNotExist:
-            return False
+        return viewer_context.for_event(self.context, obj).liked(obj.pk)
 
 
-class EventPreviewSerializer(serializers.ModelSerializer):
+class EventCountersListSerializer(EventViewerContextListSerializer):
+    """
+    Fetch counters, viewer's attending friends, attendance and comments previews of all events at once,
+    before they are serialized one by one
+    """
+
+    def to_representation(self, data):
+        events = list(data.all() if hasattr(data, 'all') else data)
+        if self.child.COUNTER_NAMES:
+            prefetched = self.context.setdefault('event_counters', {})
+            for event_id, values in counters.get_many(events, self.child.COUNTER_NAMES).items():
+                prefetched.setdefault(event_id, {}).update(values)
+        request = self.context.get('request')
+        if self.child.COUNTS_VIEWER_FRIENDS and request and request.user.is_authenticated:
+            self.context.setdefault('viewer_attending_friends', {}).update(
+                friend_counts.get_counts(request.user, [event.pk for event in events])
+            )
+        comments_count = getattr(self.child, 'COMMENTS_PREVIEW_COUNT', None)
+        if comments_count:
+            self.context['comments_previews'] = previews.comments_previews([event.pk for event in events],
+                                                                           comments_count)
+        preview_count = getattr(self.child, 'ATTENDANCE_PREVIEW_MAX_COUNT', None)
+        if preview_count and request and request.user.is_authenticated:
+            self.context.setdefault('attendance_previews', {}).update(
+                previews.attendance_previews(request.user, [event.pk for event in events], preview_count)
+            )
+        return super().to_representation(events)
+
+
+class EventCountersSerializerMixin(serializers.Serializer):
+    """Counters of event, prefetched for lists by EventCountersListSerializer"""
+    COUNTER_NAMES = counters.EVENT_COUNTERS
+    COUNTS_VIEWER_FRIENDS = True
+
+    def get_event_counters(self, obj: Event) -> dict:
+        values = self.context.get('event_counters', {}).get(obj.pk, {})
+        if not all(name in values for name in self.COUNTER_NAMES):
+            values = counters.get_many([obj], self.COUNTER_NAMES)[obj.pk]
+        return {name: values[name] for name in self.COUNTER_NAMES}
+
+    def get_viewer_attending_friends_count(self, obj: Event) -> int:
+        prefetched = self.context.get('viewer_attending_friends', {})
+        if obj.pk in prefetched:
+            return prefetched[obj.pk]
+        return friend_counts.get_counts(self.context['request'].user, [obj.pk])[obj.pk]
+
+
+class EventPreviewSerializer(CachedImagesModelSerializer):
     """Slim Event serializer class. Read only."""
     start_timezone = serializers.ChoiceField(choices=TIMEZONES_CHOICES)
     end_timezone = serializers.ChoiceField(choices=TIMEZONES_CHOICES)
@@ -96,6 +156,7 @@ class EventPreviewWithUserSerializer(EventPreviewSerializer):
 
 class EventDetailSerializer(EventViewerAttendanceStatusSerializerMixin,
                             EventLikedByViewerSerializerMixin,
+                            EventCountersSerializerMixin,
                             EventPreviewWithUserSerializer):
     """
     Most complete Event serializer.
@@ -123,6 +184,7 @@ class EventDetailSerializer(EventViewerAttendanceStatusSerializerMixin,
                   'viewer_attendance_status', 'liked_by_viewer',
                   'counters', 'attendance_preview')
         read_only_fields = ('main_image', 'main_image_cropped', 'images')
+        list_serializer_class = EventCountersListSerializer
 
     def validate_end(self, end):
         if self.instance and end < self.instance.end:
@@ -171,49 +233,36 @@ class EventDetailSerializer(EventViewerAttendanceStatusSerializerMixin,
     @swagger_serializer_method(serializer_or_field=ReminderSerializer)
     @check_if_request
     def get_viewer_reminder(self, obj) -> dict:
-        try:
-            return ReminderSerializer(
-                Reminder.objects.get(event=obj, user=self.context['request'].user)
-            ).data
-        except Reminder.DoesNotExist:
-            pass
+        reminder = viewer_context.for_event(self.context, obj).reminder(obj.pk)
+        if reminder:
+            return ReminderSerializer(reminder).data
 
     @swagger_serializer_method(serializer_or_field=UserPreviewSerializer)
     @check_if_request
     def get_viewer_inviter(self, obj):
-        try:
-            return UserPreviewSerializer(
-                EventInvite.objects.get(event=obj, invitee=self.context['request'].user).inviter
-            ).data
-        except EventInvite.DoesNotExist:
-            pass
+        inviter = viewer_context.for_event(self.context, obj).inviter(obj.pk)
+        if inviter:
+            return UserPreviewSerializer(inviter).data
 
     @check_if_request
     @swagger_serializer_method(AttendancePreviewSerializer)
     def get_attendance_preview(self, obj):
         """
         Return a few attendees for preview, sorted by status, viewer's friends first
-        This makes a request to find all friends who attend and then another one if we got <5 friends
-        You'd think you can do this with annotations, but you can't
+        Previews of a list are prefetched by EventCountersListSerializer, single event takes one query
         """
-        user = self.context['request'].user
-        base_att = Attendance.objects.select_related('user', 'event').filter(event=obj).order_by('status')
-        att_max = self.ATTENDANCE_PREVIEW_MAX_COUNT
-        res_att = list(base_att.filter(user__in=user.friends)[:att_max])
-        if len(res_att) < att_max:
-            n = att_max - len(res_att)
-            res_att += list(base_att.exclude(user__in=user.friends)[:n])
-        return AttendancePreviewSerializer(res_att, many=True, context=self.context).data
+        attendances = self.context.get('attendance_previews', {}).get(obj.pk)
+        if attendances is None:
+            attendances = previews.attendance_preview(self.context['request'].user, obj.pk,
+                                                      self.ATTENDANCE_PREVIEW_MAX_COUNT)
+        return AttendancePreviewSerializer(attendances, many=True, context=self.context).data
 
     @swagger_serializer_method(serializer_or_field=EventCountersSwaggerSerializer)
     @check_if_request
     def get_counters(self, obj: Event) -> dict:
-        data = {x: get_count_of(obj, x) for x in Attendance.CACHE_STATUS_KEYS}
+        data = dict(self.get_event_counters(obj))
         data.update({
-            EventLike.CACHE_KEY: get_count_of(obj, EventLike.CACHE_KEY),
-            EventComment.CACHE_KEY: get_count_of(obj, EventComment.CACHE_KEY),
-            'viewer_attending_friends_count': get_count_of(
-                obj, 'user_attending_friends', method_kwargs={'user': self.context['request'].user}),
+            'viewer_attending_friends_count': self.get_viewer_attending_friends_count(obj),
         })
         return data
 
@@ -300,18 +349,20 @@ class EventCategorySerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
-class EventNotificationWithLikesSerializer(serializers.ModelSerializer):
+class EventNotificationWithLikesSerializer(EventCountersSerializerMixin, serializers.ModelSerializer):
     counters = serializers.SerializerMethodField()
+    COUNTER_NAMES = (EventLike.CACHE_KEY,)
+    COUNTS_VIEWER_FRIENDS = False
 
     class Meta:
         model = Event
         fields = ('id', 'title', 'category', 'category_image', 'start', 'start_timezone', 'main_image', 'counters')
         read_only_fields = fields
+        list_serializer_class = EventCountersListSerializer
 
-    @staticmethod
     @swagger_serializer_method(serializer_or_field=EventCountersSwaggerSerializer)
-    def get_counters(obj: Event) -> dict:
-        return {EventLike.CACHE_KEY: get_count_of(obj, EventLike.CACHE_KEY)}
+    def get_counters(self, obj: Event) -> dict:
+        return self.get_event_counters(obj)
 
 
 class EventNotificationWithAttendanceStatusSerializer(EventViewerAttendanceStatusSerializerMixin,
@@ -320,6 +371,7 @@ class EventNotificationWithAttendanceStatusSerializer(EventViewerAttendanceStatu
         model = Event
         fields = ('id', 'title', 'category', 'category_image', 'start', 'start_timezone', 'main_image', 'viewer_attendance_status')
         read_only_fields = fields
+        list_serializer_class = EventViewerContextListSerializer
 
 
 class EventNotificationWithAttendanceStatusAndUserSerializer(EventViewerAttendanceStatusSerializerMixin,
@@ -330,6 +382,7 @@ class EventNotificationWithAttendanceStatusAndUserSerializer(EventViewerAttendan
         model = Event
         fields = ('id', 'title', 'category', 'category_image', 'start', 'start_timezone', 'main_image', 'user', 'viewer_attendance_status')
         read_only_fields = fields
+        list_serializer_class = EventViewerContextListSerializer
 
 
 class SwaggerEventNotificationSerializer(EventNotificationWithLikesSerializer,
@@ -366,11 +419,14 @@ class EventCommentSerializer(serializers.ModelSerializer):
 
 class EventFeedSerializer(EventViewerAttendanceStatusSerializerMixin,
                           EventLikedByViewerSerializerMixin,
+                          EventCountersSerializerMixin,
                           EventPreviewWithUserSerializer):
     """Feed-specific Event serializer. Read only."""
     comments_preview = serializers.SerializerMethodField()
     counters = serializers.SerializerMethodField()
     images = EventImageSerializer(many=True)
+    COUNTER_NAMES = (EventLike.CACHE_KEY, EventComment.CACHE_KEY)
+    COMMENTS_PREVIEW_COUNT = 2
 
     class Meta:
         model = Event
@@ -379,32 +435,31 @@ class EventFeedSerializer(EventViewerAttendanceStatusSerializerMixin,
                   'images',
                   'viewer_attendance_status', 'liked_by_viewer', 'counters', 'comments_preview')
         read_only_fields = fields
+        list_serializer_class = EventCountersListSerializer
 
     def get_comments_preview(self, obj):
-        qs = obj.comments.select_related('user').order_by('-id')[:2]
-        statuses_map = dict(
-            Attendance.objects.filter(
-                event=obj, user__in=[c.user for c in qs]).values_list('user_id', 'status')
-        )
+        comments, statuses = self.context.get('comments_previews', ({}, {}))
+        if obj.pk not in comments:
+            comments, statuses = previews.comments_previews([obj.pk], self.COMMENTS_PREVIEW_COUNT)
         serializer_context = self.context.copy()
-        serializer_context.update({'statuses_map': statuses_map})
-        return EventCommentSerializer(qs, many=True, context=serializer_context).data
+        serializer_context.update({'statuses_map': statuses[obj.pk]})
+        return EventCommentSerializer(comments[obj.pk], many=True, context=serializer_context).data
 
     @swagger_serializer_method(serializer_or_field=EventCountersSwaggerSerializer)
     @check_if_request
     def get_counters(self, obj: Event) -> dict:
         return {
-            EventLike.CACHE_KEY: get_count_of(obj, EventLike.CACHE_KEY),
-            EventComment.CACHE_KEY: get_count_of(obj, EventComment.CACHE_KEY),
-            'viewer_attending_friends_count': get_count_of(
-                obj, 'user_attending_friends', method_kwargs={'user': self.context['request'].user})
+            **self.get_event_counters(obj),
+            'viewer_attending_friends_count': self.get_viewer_attending_friends_count(obj)
         }
 
 
 class TaggedEventSerialzier(EventViewerAttendanceStatusSerializerMixin,
+                            EventCountersSerializerMixin,
                             EventPreviewSerializer):
     """Related event data to display in posts and stories"""
     counters = serializers.SerializerMethodField()
+    COUNTER_NAMES = ()
 
     class Meta:
         """TaggedEventSerialzier metaclass"""
@@ -413,13 +468,13 @@ class TaggedEventSerialzier(EventViewerAttendanceStatusSerializerMixin,
                   'start', 'start_timezone', 'end', 'end_timezone',
                   'viewer_attendance_status', 'counters')
         read_only_fields = fields
+        list_serializer_class = EventCountersListSerializer
 
     @check_if_request
     @swagger_serializer_method(EventCountersSwaggerSerializer)
     def get_counters(self, obj: Event) -> dict:
         return {
-            'viewer_attending_friends_count': get_count_of(
-                obj, 'user_attending_friends', method_kwargs={'user': self.context['request'].user})
+            'viewer_attending_friends_count': self.get_viewer_attending_friends_count(obj)
         }
 
 
@@ -10,6 +10,7 @@ from rest_framework.pagination import LimitOffsetPagination
 
 from campaigns.api.serializers import CampaignEventSerializer
 from campaigns.models import Campaign
+from events.api.fast_serializers import CompiledListMixin
 from events.api.filters import (CategoriesCampaignsFilterSet,
                                 CategoriesFilterSet)
 from events.api.serializers import (EventCategorySerializer,
@@ -23,7 +24,7 @@ class EventCategoryView(generics.ListAPIView):
     queryset = EventCategory.objects.filter()
 
 
-class DiscoveryView(generics.ListAPIView):
+class DiscoveryView(CompiledListMixin, generics.ListAPIView):
     """Get discovery based on regular events"""
     serializer_class = EventDiscoveryPreviewSerializer
     pagination_class = LimitOffsetPagination
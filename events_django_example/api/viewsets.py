@@ -20,6 +20,8 @@ from rest_framework.response import Response
 from rest_framework.status import (HTTP_200_OK, HTTP_204_NO_CONTENT,
                                    HTTP_400_BAD_REQUEST)
 
+from events import outbox
+from events.api.fast_serializers import CompiledListMixin
 from events.api.filters import (AttendanceFilterSet,
                                 AttendanceUserRelationFilter,
                                 EventDateTimeFilter,
@@ -27,6 +29,7 @@ from events.api.filters import (AttendanceFilterSet,
 from events.api.permissions import (IsOwnerOrReadOnly,
                                     RelatedEventObjectPermission,
                                     RelatedEventOwner)
+from events.api.prefetch import PlannedQuerysetMixin
 from events.api.serializers import (AttendanceSerializer,
                                     EventCommentSerializer,
                                     EventDetailSerializer,
@@ -35,6 +38,7 @@ from events.api.serializers import (AttendanceSerializer,
                                     UserAttendanceSerializer)
 from events.models import (Attendance, Event, EventComment, EventImage,
                            EventInvite, EventLike, Reminder)
+from events.services import bulk_invite, bulk_uninvite, delete_events
 from notifications.models import Notification
 from notifications.tasks import create_event_change_notification
 from posts.api.serializers import PostPreviewSerializer
@@ -54,8 +58,8 @@ class ExtendedNestedEventViewSetMixin(ExtendedNestedViewSetMixin):
 @method_decorator(name='list', decorator=swagger_auto_schema(
     manual_parameters=[*EventDateTimeFilter.SWAGGER_PARAMS],
     responses={HTTP_200_OK: EventPreviewSerializer}))
-class EventViewSet(viewsets.ModelViewSet):
-    """Basic event viewset"""
+class EventViewSet(CompiledListMixin, PlannedQuerysetMixin, viewsets.ModelViewSet):
+    """Basic event viewset, list previews are built from values rows"""
     queryset = Event.objects.all()
     permission_classes = (IsAuthenticated, IsOwnerOrReadOnly)
     http_method_names = ('get', 'post', 'patch', 'delete')
@@ -68,6 +72,9 @@ class EventViewSet(viewsets.ModelViewSet):
         """Perform create for current user"""
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        delete_events(Event.objects.filter(pk=instance.pk))
+
     def perform_update(self, serializer):
         if serializer.validated_data.get('main_image_crop_points'):
             main_img = self.get_object().images.order_by('position').first()
@@ -84,8 +91,8 @@ class EventViewSet(viewsets.ModelViewSet):
             if any(x in serializer.validated_data for x in Notification.EVENT_CHANGE_FIELDS):
                 # send task for updating event in notification service
                 # also check if start time was updated for updating all of the reminders
-                create_event_change_notification.delay(
-                    actor_id=self.request.user.id, target_id=serializer.data['id'],
+                outbox.enqueue(
+                    create_event_change_notification, actor_id=self.request.user.id, target_id=serializer.data['id'],
                     update_reminders=Notification.REMINDER_UPDATE_EVENT_FIELD in serializer.validated_data
                 )
 
@@ -99,9 +106,9 @@ class EventViewSet(viewsets.ModelViewSet):
         if getattr(self, 'swagger_fake_view', False):
             # queryset just for schema generation metadata
             return Event.objects.none()
-        return Event.objects.filter(
+        return self.plan_queryset(Event.objects.filter(
             Q(user=self.request.user) | Q(is_private=False) | Q(attendance__user=self.request.user)
-        ).distinct()
+        ).distinct())
 
     @swagger_auto_schema(
         operation_description="Invite users to this event by list of their ids",
@@ -123,11 +130,11 @@ class EventViewSet(viewsets.ModelViewSet):
 
         users = User.objects.filter(id__in=user_ids)
         invitable_users = users.exclude(attends=this_event).exclude(pk=request.user.id)
-        if not invitable_users.exists():
+        invitee_ids = list(invitable_users.values_list('id', flat=True))
+        if not invitee_ids:
             return Response({'message': 'No invitable users were passed'})
 
-        for u in invitable_users:
-            EventInvite.objects.create(event=this_event, inviter=request.user, invitee=u)
+        bulk_invite(this_event, request.user, invitee_ids)
 
         return Response(status=HTTP_204_NO_CONTENT)
 
@@ -143,10 +150,7 @@ class EventViewSet(viewsets.ModelViewSet):
         user_ids = lookup_serializer.validated_data.get('ids')
 
         event = self.get_object()
-        qs = Attendance.objects.filter(event=event, user__id__in=user_ids, status=Attendance.INVITE_PENDING)
-        if event.user != request.user:
-            qs = qs.filter(invite__inviter=request.user)
-        qs.delete()
+        bulk_uninvite(event, user_ids, inviter=None if event.user == request.user else request.user)
 
         return Response(status=HTTP_204_NO_CONTENT)
 
@@ -0,0 +1,10 @@
+"""Benchmarks of event app
+
+Modules which don't touch database are scripts, run from project root:
+
+    python -m events.benchmarks.descriptions
+
+Modules which need database are test cases left out of the test suite, run them by label with a test database:
+
+    python manage.py test events.benchmarks.subscribers
+"""
@@ -0,0 +1,81 @@
+"""Description text extraction against the BeautifulSoup path it replaced
+
+Corpus is made of descriptions as google calendar and microsoft graph send them, each repeated as many times
+as recurring events bring it in one sync. Times are per description. Memo is cleared before every cold round,
+so it only catches repeats within a sync there; warm rounds show a resync of the same calendar.
+
+    python -m events.benchmarks.descriptions [--rounds N]
+"""
+
+import argparse
+import json
+import os
+import timeit
+
+from bs4 import BeautifulSoup
+
+from events import descriptions
+from events.descriptions import html_to_text
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'descriptions.json')
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list:
+    """(content, body_only) of every description of a sync"""
+    with open(path, encoding='utf-8') as corpus_file:
+        items = json.load(corpus_file)
+    return [(item['content'], item['body_only']) for item in items for _ in range(item['repeat'])]
+
+
+def soup_text(content: str, body_only: bool) -> str:
+    """Description text as sync tasks got it before events.descriptions"""
+    soup = BeautifulSoup(content, 'lxml')
+    if body_only:
+        body = soup.find('body')
+        return (body if body else soup).get_text().strip()
+    return soup.get_text().strip()
+
+
+def unmemoized_text(content: str, body_only: bool) -> str:
+    """html_to_text with every description parsed again, shows parsing alone"""
+    if not content:
+        return ''
+    if descriptions.is_plain_text(content):
+        return content.strip()
+    return descriptions._extract_text.__wrapped__(content, body_only)
+
+
+def _run(extract, corpus: list, clear_memo: bool = False) -> None:
+    if clear_memo:
+        descriptions._extract_text.cache_clear()
+    for content, body_only in corpus:
+        extract(content, body_only)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    rounds = parser.parse_args().rounds
+
+    corpus = load_corpus()
+    mismatches = [content for content, body_only in corpus
+                  if html_to_text(content, body_only) != soup_text(content, body_only)]
+    if mismatches:
+        raise SystemExit(f'{len(mismatches)} descriptions differ from BeautifulSoup text, first: {mismatches[0]!r}')
+
+    results = {
+        'BeautifulSoup': timeit.timeit(lambda: _run(soup_text, corpus), number=rounds),
+        'html_to_text, no memo': timeit.timeit(lambda: _run(unmemoized_text, corpus), number=rounds),
+        'html_to_text, cold memo': timeit.timeit(lambda: _run(html_to_text, corpus, clear_memo=True), number=rounds),
+        'html_to_text, warm memo': timeit.timeit(lambda: _run(html_to_text, corpus), number=rounds),
+    }
+
+    baseline = results['BeautifulSoup']
+    print(f'{len(corpus)} descriptions, {rounds} rounds')
+    for name, seconds in results.items():
+        per_description = seconds / rounds / len(corpus) * 1e6
+        print(f'{name:<26}{per_description:>10.1f} us/description{baseline / seconds:>10.1f}x')
+
+
+if __name__ == '__main__':
+    main()
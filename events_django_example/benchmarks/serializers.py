@@ -0,0 +1,68 @@
+"""Throughput of compiled preview serializers against DRF
+
+Every preview serializer builds pages of 1k and 10k events both ways, query included, and rows per second are
+compared. Serializers which don't compile are reported and go through DRF in views.
+
+    python manage.py test events.benchmarks.serializers
+"""
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase, tag
+from django.utils import timezone
+
+from events.api.fast_serializers import compile_serializer
+from events.api.serializers import (EventDiscoveryPreviewSerializer,
+                                    EventPreviewSerializer,
+                                    EventPreviewWithUserSerializer)
+from events.models import Event
+from system.timezones import TIMEZONES
+
+ROW_COUNTS = (1000, 10000)
+SERIALIZERS = (EventPreviewSerializer, EventPreviewWithUserSerializer, EventDiscoveryPreviewSerializer)
+ROUNDS = 3
+
+
+def _best_time(func) -> float:
+    times = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+@tag('benchmark')
+class CompiledSerializersBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = get_user_model().objects.create_user(email='owner@example.com', first_name='Owner',
+                                                     password='12345678ABC')
+        Event.objects.bulk_create([
+            Event(title=f'Title {i}', user=owner, is_private=False,
+                  start_timezone=TIMEZONES[i % len(TIMEZONES)], start=timezone.now(),
+                  end_timezone=TIMEZONES[0], end=timezone.now(),
+                  main_image=f'e/{i}/main.jpg' if i % 2 else None,
+                  main_image_cropped=f'e/{i}/main_cropped.jpg' if i % 2 else '')
+            for i in range(max(ROW_COUNTS))
+        ])
+
+    def test_throughput(self):
+        context = {'request': RequestFactory().get('/')}
+        print(f'\n{"serializer":<34}{"rows":>7}{"DRF, rows/s":>14}{"compiled, rows/s":>18}{"speedup":>9}')
+
+        for serializer_class in SERIALIZERS:
+            compiled = compile_serializer(serializer_class)
+            for count in ROW_COUNTS:
+                queryset = Event.objects.order_by('id')[:count]
+                drf = _best_time(lambda: serializer_class(queryset, many=True, context=context).data)
+                if compiled is None:
+                    print(f'{serializer_class.__name__:<34}{count:>7}{count / drf:>14.0f}{"not compiled":>18}')
+                    continue
+
+                self.assertEqual(compiled.serialize(compiled.values(queryset), context),
+                                 serializer_class(queryset, many=True, context=context).data)
+                fast = _best_time(lambda: compiled.serialize(compiled.values(queryset), context))
+                print(f'{serializer_class.__name__:<34}{count:>7}{count / drf:>14.0f}{count / fast:>18.0f}'
+                      f'{drf / fast:>8.1f}x')
@@ -0,0 +1,108 @@
+"""Event creation latency against number of creator subscribers
+
+For every subscribers count it times what the creating request waits for: a public event created through its
+signals, and a page of events created by calendar sync from the fake provider. Subscriber attendances are made
+in background, the time of that fan-out is shown next to it with its chunk tasks run in place.
+
+    python manage.py test events.benchmarks.subscribers
+"""
+
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings, tag
+from django.utils import timezone
+
+from events.calendar_client import reset_session
+from events.fake_provider import FakeCalendarProvider
+from events.models import Attendance, Event
+from events.tasks import (create_attendance_for_subscribers,
+                          create_attendance_for_subscribers_chunk,
+                          sync_google_events)
+from system.timezones import TIMEZONES
+from users.models import Subscription, UserSocialAuth
+
+SUBSCRIBER_COUNTS = (0, 100, 1000, 10000)
+SYNCED_EVENTS = 50
+ROUNDS = 5
+
+
+def _google_event(external_id: str) -> dict:
+    return {
+        'id': external_id,
+        'status': 'confirmed',
+        'summary': 'Title',
+        'description': 'Weekly sync',
+        'start': {'dateTime': '2020-07-10T12:00:00Z'},
+        'end': {'dateTime': '2020-07-10T13:00:00Z'},
+    }
+
+
+def _run_chunk_in_place(event_id, subscriber_ids):
+    create_attendance_for_subscribers_chunk.apply(args=(event_id, subscriber_ids))
+
+
+@tag('benchmark')
+class SubscribersFanOutBenchmark(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create_user(email='owner@example.com', first_name='Owner', password='12345678ABC')
+        self.social = UserSocialAuth.objects.create(user=self.owner, provider='google-oauth2', uid='owner',
+                                                    extra_data={'access_token': 'token'})
+        reset_session()
+
+    def _add_subscribers(self, offset: int, count: int) -> None:
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(email=f'subscriber{i}@example.com', first_name='Subscriber') for i in range(offset, offset + count)
+        ])
+        Subscription.objects.bulk_create([Subscription(user=user, target=self.owner) for user in users])
+
+    def _create_public_event(self) -> Event:
+        return Event.objects.create(title='Title', user=self.owner, is_private=False,
+                                    start_timezone=TIMEZONES[0], start=timezone.now(),
+                                    end_timezone=TIMEZONES[0], end=timezone.now())
+
+    def _sync_page(self, provider: FakeCalendarProvider, round_id: str) -> None:
+        provider.google_events = [_google_event(f'{round_id}-{i}') for i in range(SYNCED_EVENTS)]
+        # every round is a full sync of new events
+        self.social.calendar_data = {}
+        self.social.save(update_fields=['calendar_data'])
+        sync_google_events.apply(args=(self.social.id,))
+
+    def test_creation_latency_by_subscribers_count(self):
+        rows = []
+        subscribers = 0
+        with FakeCalendarProvider(page_size=SYNCED_EVENTS) as provider, \
+                override_settings(GOOGLE_CALENDAR_API_URL=provider.url), \
+                mock.patch.object(create_attendance_for_subscribers, 'delay'), \
+                mock.patch.object(create_attendance_for_subscribers_chunk, 'delay', _run_chunk_in_place):
+            for count in SUBSCRIBER_COUNTS:
+                self._add_subscribers(subscribers, count - subscribers)
+                subscribers = count
+
+                create, sync, fan_out = [], [], []
+                for i in range(ROUNDS):
+                    started = time.perf_counter()
+                    event = self._create_public_event()
+                    create.append(time.perf_counter() - started)
+
+                    started = time.perf_counter()
+                    self._sync_page(provider, f'{count}-{i}')
+                    sync.append(time.perf_counter() - started)
+
+                    started = time.perf_counter()
+                    create_attendance_for_subscribers.apply(args=(event.id, self.owner.id))
+                    fan_out.append(time.perf_counter() - started)
+                    self.assertEqual(Attendance.objects.filter(event=event, is_from_subscription=True).count(), count)
+
+                rows.append((count, min(create), min(sync), min(fan_out)))
+
+        print(f'\n{"subscribers":>12}{"create event, ms":>18}{f"sync {SYNCED_EVENTS} events, ms":>22}'
+              f'{"background fan-out, ms":>24}')
+        for count, create, sync, fan_out in rows:
+            print(f'{count:>12}{create * 1000:>18.1f}{sync * 1000:>22.1f}{fan_out * 1000:>24.1f}')
+
+        # request latency must not follow subscribers count, only background work does
+        self.assertLess(rows[-1][1], rows[0][1] * 10)
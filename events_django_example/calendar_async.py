@@ -0,0 +1,174 @@
+"""Asyncio engine for syncing many calendar accounts from one worker process
+
+Provider requests of all accounts run concurrently over one pooled aiohttp session, database work is done
+in a small thread pool with the same page sync functions celery tasks use. aiohttp is an optional dependency.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from rest_framework import status
+
+from events.calendar_client import (DEFAULT_TIMEOUT, ProviderResponseError,
+                                    auth_headers, google_url, graph_url)
+from events.scheduler import (ProviderBusy, SyncRunning,
+                              acquire_provider_slot, acquire_running_lock,
+                              release_provider_slot, release_running_lock)
+from events.tasks import (GOOGLE_EVENTS_PATH, OUTLOOK_DELTA_PATH,
+                          sync_google_events_page, sync_outlook_events_page,
+                          update_calendar_data)
+from users.models import UserSocialAuth
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_CONCURRENCY = 20
+DB_WORKERS = 4
+
+
+def _in_db_thread(func, *args, **kwargs):
+    """Run func with request-like connection handling, executor threads outlive single calls"""
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class AccountsSyncEngine:
+    """Sync calendars of many user social auths concurrently"""
+
+    def __init__(self, http, db_executor: ThreadPoolExecutor, concurrency: int):
+        self.http = http
+        self.db_executor = db_executor
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def db(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_executor, partial(_in_db_thread, func, *args, **kwargs))
+
+    async def get_json(self, url: str, headers: dict, params: dict = None):
+        """Get status and decoded body of provider response"""
+        async with self.semaphore:
+            async with self.http.get(url, headers=headers, params=params) as response:
+                return response.status, await response.json(content_type=None)
+
+    async def sync(self, social_id: int) -> None:
+        """
+        Sync account unless sync task or another engine syncs it right now
+        Takes a sync slot of provider like sync tasks do, raises ProviderBusy if provider has no free slots
+        """
+        token = await self.db(acquire_running_lock, social_id)
+        if token is None:
+            raise SyncRunning(social_id)
+        try:
+            social = await self.db(UserSocialAuth.objects.select_related('user').get, pk=social_id)
+            if not await self.db(acquire_provider_slot, social.provider):
+                raise ProviderBusy(social.provider)
+            try:
+                headers = await self.db(auth_headers, social)
+                if social.provider == 'google-oauth2':
+                    await self.sync_google(social, headers)
+                elif social.provider == 'microsoft-graph':
+                    await self.sync_outlook(social, headers)
+            finally:
+                await self.db(release_provider_slot, social.provider)
+        finally:
+            await self.db(release_running_lock, social_id, token)
+
+    async def sync_google(self, social: UserSocialAuth, headers: dict) -> None:
+        """Same flow as sync_google_events task"""
+        url = google_url(GOOGLE_EVENTS_PATH)
+        sync_token = social.calendar_data.get('sync_token')
+        query_params = {'timeZone': 'utc'}
+
+        if sync_token:
+            query_params['syncToken'] = sync_token
+        else:
+            query_params['timeMin'], query_params['timeMax'] = UserSocialAuth.get_sync_bounds()
+
+        while True:
+            status_code, result = await self.get_json(url, headers, query_params)
+            if status_code == status.HTTP_410_GONE and \
+                    result['error']['errors'][0]['reason'] == 'fullSyncRequired':
+                query_params.pop('syncToken')
+                query_params.pop('pageToken', None)
+                query_params['timeMin'], query_params['timeMax'] = UserSocialAuth.get_sync_bounds()
+                continue
+            if status_code != status.HTTP_200_OK:
+                raise ProviderResponseError(status_code, str(result))
+
+            await self.db(sync_google_events_page, result['items'], user=social.user,
+                          user_timezone=result['timeZone'])
+
+            sync_token = result.get('nextSyncToken')
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+            query_params['pageToken'] = page_token
+
+        await self.db(update_calendar_data, social.pk, sync_token=sync_token)
+
+    async def sync_outlook(self, social: UserSocialAuth, headers: dict) -> None:
+        """Same flow as sync_outlook_events task"""
+        delta_link = social.calendar_data.get('delta_link')
+        query_params = dict()
+
+        if delta_link:
+            url = delta_link
+        else:
+            url = graph_url(OUTLOOK_DELTA_PATH)
+            query_params['startDateTime'], query_params['endDateTime'] = UserSocialAuth.get_sync_bounds()
+
+        while True:
+            status_code, result = await self.get_json(url, headers, query_params)
+            if status_code != status.HTTP_200_OK:
+                raise ProviderResponseError(status_code, str(result))
+
+            events = result['value']
+            await self.db(sync_outlook_events_page, events, user=social.user)
+
+            delta_link = result.get('@odata.deltaLink')
+            url = delta_link or result.get('@odata.nextLink')
+            query_params = dict()
+
+            if not events:
+                break
+
+        await self.db(update_calendar_data, social.pk, delta_link=delta_link)
+
+
+async def _sync_accounts(social_ids: list, concurrency: int) -> Dict[int, str]:
+    connect_timeout, read_timeout = getattr(settings, 'CALENDAR_HTTP_TIMEOUT', DEFAULT_TIMEOUT)
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    with ThreadPoolExecutor(max_workers=DB_WORKERS) as db_executor:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+            engine = AccountsSyncEngine(http, db_executor, concurrency)
+            results = await asyncio.gather(*(engine.sync(social_id) for social_id in social_ids),
+                                           return_exceptions=True)
+
+    return {
+        social_id: repr(result)
+        for social_id, result in zip(social_ids, results)
+        if isinstance(result, Exception)
+    }
+
+
+def sync_accounts(social_ids: Iterable[int], concurrency: int = None) -> Dict[int, str]:
+    """
+    Sync calendars of all passed user social auths concurrently
+    Return errors of failed accounts by social id, one failed account doesn't stop the others
+    """
+    if aiohttp is None:
+        raise ImproperlyConfigured('aiohttp is required for concurrent calendar sync')
+    concurrency = concurrency or getattr(settings, 'CALENDAR_SYNC_CONCURRENCY', DEFAULT_CONCURRENCY)
+    return asyncio.run(_sync_accounts(list(social_ids), concurrency))
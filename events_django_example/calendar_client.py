@@ -0,0 +1,141 @@
+"""HTTP client for calendar providers
+
+All calls to google/microsoft apis go through one process wide session, so TCP+TLS connections are kept alive
+and reused between tasks. Every host gets its own connection pool and every request has a timeout.
+"""
+
+import queue
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from social_django.utils import load_strategy
+from urllib3.util.retry import Retry
+
+GOOGLE_API_URL = 'https://www.googleapis.com'
+GRAPH_API_URL = 'https://graph.microsoft.com'
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 30)
+# number of hosts to keep pools for and number of kept alive connections per host
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+# number of pages fetched ahead of database writes
+DEFAULT_PREFETCH_PAGES = 2
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class ProviderResponseError(Exception):
+    """Provider answered with unexpected status"""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f'{status_code}: {text}')
+        self.status_code = status_code
+        self.text = text
+
+
+class ProviderSession(requests.Session):
+    """Session with per host connection pools and default timeout"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        super().__init__()
+        self.timeout = timeout
+        # retry only failed connects, requests could have been applied by provider already
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                              max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2))
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_session() -> ProviderSession:
+    """Get shared provider session, it is created lazily so every worker process gets its own pools"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = ProviderSession(
+                    timeout=getattr(settings, 'CALENDAR_HTTP_TIMEOUT', DEFAULT_TIMEOUT),
+                    pool_maxsize=getattr(settings, 'CALENDAR_HTTP_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE),
+                )
+    return _session
+
+
+def reset_session() -> None:
+    """Close shared session, next call of get_session creates a new one"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def google_url(path: str) -> str:
+    return getattr(settings, 'GOOGLE_CALENDAR_API_URL', GOOGLE_API_URL) + path
+
+
+def graph_url(path: str) -> str:
+    return getattr(settings, 'MS_GRAPH_API_URL', GRAPH_API_URL) + path
+
+
+def auth_headers(social) -> dict:
+    """Authorization headers for user social auth, refreshes access token if needed"""
+    return {"Authorization": f"Bearer {social.get_access_token(load_strategy())}"}
+
+
+_DONE = object()
+
+
+def prefetch(iterable, size: int):
+    """
+    Iterate over @iterable in a background thread, keeping up to @size items ready ahead of the consumer
+    So next pages are downloaded while the current one is written to database.
+    Exceptions of producer are raised in consumer, size 0 iterates in place.
+    """
+    if size <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((_DONE, e))
+        else:
+            put((_DONE, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # consumer is done or failed, let producer exit
+        stop.set()
+        producer.join()
@@ -0,0 +1,310 @@
+"""Cached counters of events
+
+Counter changes made by signals are buffered per request (events.middleware.CounterBatchMiddleware) or celery
+task and written to cache at once when it ends, only for committed transactions. With django-redis the write is one round trip for all keys.
+Rows are the source of truth: a counter missing in cache is counted on read, with one grouped query per counted
+model for all events of a page. A pending key is set before counting, changes written while the count runs are
+kept in it and added to the counted value when it is cached. Changes of counters which are neither cached nor
+being counted are not written.
+Reads of many events take one cache round trip and go through a short-lived per-process copy, which is dropped
+for counters changed by this process, so its own writes are seen at once.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Iterable, List, Tuple
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from events.models import Attendance, Event, EventComment, EventLike
+from prism.utils.cache_utils import decr_in_cache, incr_in_cache
+
+KEY = 'event_counter_{}_{}'
+PENDING_KEY = 'event_counter_pending_{}_{}'
+EVENT_COUNTERS = (*Attendance.CACHE_STATUS_KEYS, EventLike.CACHE_KEY, EventComment.CACHE_KEY)
+TIMEOUT = 60 * 60 * 24 * 7
+# seconds pending key outlives a count which didn't cache its result
+PENDING_TIMEOUT = 60
+# seconds counters are kept in memory of process
+DEFAULT_LOCAL_TTL = 2
+# memory copy is dropped at once when it grows over this number of counters
+LOCAL_MAX_SIZE = 50000
+
+# KEYS are pairs of counter key and its pending key: increment counter if it is cached, pending key if counter is
+# being counted, missing ones are counted on read
+INCR_SCRIPT = """
+for i = 1, #KEYS, 2 do
+    local delta = ARGV[(i + 1) / 2]
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('INCRBY', KEYS[i], delta)
+    elseif redis.call('EXISTS', KEYS[i + 1]) == 1 then
+        redis.call('INCRBY', KEYS[i + 1], delta)
+    end
+end
+"""
+
+# KEYS are pairs of counter key and its pending key, ARGV are counted values and timeout: cache counted value with
+# changes written while it was counted unless other process cached the counter first, return cached values
+FILL_SCRIPT = """
+local values = {}
+for i = 1, #KEYS, 2 do
+    local pending = tonumber(redis.call('GET', KEYS[i + 1]) or 0)
+    redis.call('DEL', KEYS[i + 1])
+    if not redis.call('SET', KEYS[i], ARGV[(i + 1) / 2] + pending, 'NX', 'EX', ARGV[#ARGV]) and pending ~= 0 then
+        redis.call('INCRBY', KEYS[i], pending)
+    end
+    values[#values + 1] = redis.call('GET', KEYS[i])
+end
+return values
+"""
+
+_local = threading.local()
+# counter key -> (value, expiration time), shared by threads of process
+_local_cache = {}
+
+STATUS_BY_COUNTER = {name: status for status, name in Attendance.CACHE_STATUS_KEY_MAP.items()}
+
+CounterId = Tuple[type, int, str]
+
+
+def counter_key(event_id: int, name: str) -> str:
+    return KEY.format(event_id, name)
+
+
+def pending_key(event_id: int, name: str) -> str:
+    return PENDING_KEY.format(event_id, name)
+
+
+def _redis_client():
+    client = getattr(cache, 'client', None)
+    if client is not None and hasattr(client, 'get_client'):
+        return client.get_client(write=True)
+
+
+def _write_event_counters(deltas: Dict[Tuple[int, str], int]) -> None:
+    for counter in deltas:
+        _local_cache.pop(counter_key(*counter), None)
+
+    client = _redis_client()
+    if client is not None:
+        keys = [cache.make_key(key) for counter in deltas for key in (counter_key(*counter), pending_key(*counter))]
+        client.eval(INCR_SCRIPT, len(keys), *keys, *deltas.values())
+        return
+
+    for counter, delta in deltas.items():
+        for key in (counter_key(*counter), pending_key(*counter)):
+            try:
+                cache.incr(key, delta)
+                break
+            except ValueError:
+                # counter is not cached or being counted, it is counted on read
+                pass
+
+
+def flush(deltas: Dict[CounterId, int]) -> None:
+    """Write summed counter changes"""
+    event_deltas = {}
+    for (model, pk, name), delta in deltas.items():
+        if not delta:
+            continue
+        if model is Event:
+            event_deltas[(pk, name)] = delta
+        else:
+            # counters of other apps are kept by cache utils
+            change = incr_in_cache if delta > 0 else decr_in_cache
+            for _ in range(abs(delta)):
+                change(model, pk, name)
+
+    if event_deltas:
+        _write_event_counters(event_deltas)
+
+
+def _apply(counter: CounterId, delta: int) -> None:
+    deltas = getattr(_local, 'deltas', None)
+    if deltas is None:
+        flush({counter: delta})
+    else:
+        deltas[counter] += delta
+
+
+def incr(model, pk: int, name: str, delta: int = 1) -> None:
+    """Change counter once current transaction is committed"""
+    transaction.on_commit(partial(_apply, (model, pk, name), delta))
+
+
+def decr(model, pk: int, name: str, delta: int = 1) -> None:
+    incr(model, pk, name, -delta)
+
+
+def start_batch() -> None:
+    """Start buffering counter changes of current thread"""
+    if getattr(_local, 'deltas', None) is None:
+        _local.deltas = defaultdict(int)
+
+
+def end_batch() -> None:
+    """Write buffered counter changes of current thread"""
+    deltas, _local.deltas = getattr(_local, 'deltas', None), None
+    if deltas:
+        flush(deltas)
+
+
+@contextmanager
+def batch():
+    """Buffer counter changes of the block and write them when it exits"""
+    if getattr(_local, 'deltas', None) is not None:
+        # nested, outer block writes
+        yield
+        return
+
+    start_batch()
+    try:
+        yield
+    finally:
+        end_batch()
+
+
+@task_prerun.connect
+def _start_task_batch(**kwargs):
+    start_batch()
+
+
+@task_postrun.connect
+def _end_task_batch(**kwargs):
+    end_batch()
+
+
+def drop(event_ids: Iterable[int], names=EVENT_COUNTERS) -> None:
+    """Forget cached counters of deleted events"""
+    keys = [counter_key(event_id, name) for event_id in event_ids for name in names]
+    for key in keys:
+        _local_cache.pop(key, None)
+    cache.delete_many(keys)
+
+
+def clear_local_cache() -> None:
+    _local_cache.clear()
+
+
+def _grouped_counts(queryset, field: str = None) -> Dict[tuple, int]:
+    fields = ('event_id', field) if field else ('event_id',)
+    return {
+        tuple(row[name] for name in fields): row['count']
+        for row in queryset.values(*fields).annotate(count=Count('id')).order_by()
+    }
+
+
+def _count_in_db(events: Dict[int, Event], missing: List[Tuple[int, str]]) -> Dict[Tuple[int, str], int]:
+    """Count counters with one grouped query per counted model"""
+    event_ids = {event_id for event_id, _ in missing}
+    names = {name for _, name in missing}
+    if names & set(STATUS_BY_COUNTER):
+        by_status = _grouped_counts(Attendance.objects.filter(event_id__in=event_ids), 'status')
+    if EventLike.CACHE_KEY in names:
+        likes = _grouped_counts(EventLike.objects.filter(event_id__in=event_ids))
+    if EventComment.CACHE_KEY in names:
+        comments = _grouped_counts(EventComment.objects.filter(event_id__in=event_ids))
+
+    values = {}
+    for event_id, name in missing:
+        if name in STATUS_BY_COUNTER:
+            value = by_status.get((event_id, STATUS_BY_COUNTER[name]), 0)
+        elif name == EventLike.CACHE_KEY:
+            value = likes.get((event_id,), 0)
+        elif name == EventComment.CACHE_KEY:
+            value = comments.get((event_id,), 0)
+        else:
+            value = getattr(events[event_id], name).count()
+        values[(event_id, name)] = value
+    return values
+
+
+def _start_counting(counters: List[Tuple[int, str]]) -> None:
+    """Set pending keys of counters, changes written from now on are kept for the counted values"""
+    client = _redis_client()
+    if client is not None:
+        pipeline = client.pipeline(transaction=False)
+        for counter in counters:
+            pipeline.set(cache.make_key(pending_key(*counter)), 0, nx=True, ex=PENDING_TIMEOUT)
+        pipeline.execute()
+        return
+
+    for counter in counters:
+        cache.add(pending_key(*counter), 0, PENDING_TIMEOUT)
+
+
+def _fill(counted: Dict[Tuple[int, str], int]) -> Dict[str, int]:
+    """
+    Cache counted values with changes written while they were counted, return values which are cached now
+    Counter filled by other process may already have changes written to it, so it is read back, not overwritten.
+    Changes buffered by this thread are in the counted rows already and are written to the cached value later.
+    """
+    buffered = getattr(_local, 'deltas', None) or {}
+    values = {counter: value - buffered.get((Event, *counter), 0) for counter, value in counted.items()}
+
+    client = _redis_client()
+    if client is not None:
+        keys = [cache.make_key(key) for counter in values for key in (counter_key(*counter), pending_key(*counter))]
+        cached = client.eval(FILL_SCRIPT, len(keys), *keys, *values.values(), TIMEOUT)
+        return {counter_key(*counter): int(value) for counter, value in zip(values, cached)}
+
+    for counter, value in values.items():
+        cache.add(counter_key(*counter), value, TIMEOUT)
+        # counter is cached now, changes don't go to pending key anymore
+        pending = cache.get(pending_key(*counter))
+        cache.delete(pending_key(*counter))
+        if pending:
+            try:
+                cache.incr(counter_key(*counter), pending)
+            except ValueError:
+                pass
+    fetched = cache.get_many([counter_key(*counter) for counter in values])
+    # counters which expired again right after are left with the counted value
+    return {counter_key(*counter): fetched.get(counter_key(*counter), value) for counter, value in values.items()}
+
+
+def get_many(events: Iterable[Event], names=EVENT_COUNTERS) -> Dict[int, Dict[str, int]]:
+    """
+    Get counters of events with one cache round trip: event id -> counter name -> value
+    Counters missing in cache are counted with a few grouped queries.
+    """
+    events = {event.pk: event for event in events}
+    keys = {counter_key(event_id, name): (event_id, name) for event_id in events for name in names}
+    values = {}
+
+    now = time.monotonic()
+    for key, counter in keys.items():
+        value, expires = _local_cache.get(key, (None, 0))
+        if expires > now:
+            values[counter] = value
+
+    shared_keys = [key for key, counter in keys.items() if counter not in values]
+    fetched = cache.get_many(shared_keys) if shared_keys else {}
+    missing = [keys[key] for key in shared_keys if key not in fetched]
+    if missing:
+        _start_counting(missing)
+        fetched.update(_fill(_count_in_db(events, missing)))
+
+    expires = now + getattr(settings, 'EVENT_COUNTERS_LOCAL_TTL', DEFAULT_LOCAL_TTL)
+    if len(_local_cache) > LOCAL_MAX_SIZE:
+        _local_cache.clear()
+    for key, value in fetched.items():
+        _local_cache[key] = (value, expires)
+        values[keys[key]] = value
+
+    result = {event_id: {} for event_id in events}
+    for (event_id, name), value in values.items():
+        result[event_id][name] = value
+    return result
+
+
+def get_count(event: Event, name: str) -> int:
+    """Get counter of event, counting it if it is not cached"""
+    return get_many([event], [name])[event.pk][name]
@@ -0,0 +1,108 @@
+"""Plain text of provider event descriptions
+
+Most descriptions are plain text or small html snippets, so building a full soup tree for every one of them
+is a waste. Plain text is returned as is, html is streamed through lxml parser into a target that only keeps
+text, and results are memoized, as recurring events come with the same description on every sync.
+The target sees the same parser events BeautifulSoup builds its tree of, so text is the same as its get_text().
+"""
+
+from functools import lru_cache
+
+from lxml import etree
+
+MEMO_SIZE = 2048
+
+# characters which lxml changes or treats as markup, text without them is parsed into itself
+MARKUP_CHARACTERS = frozenset('<&\r\x00\ufeff')
+
+
+class _TextTarget:
+    """lxml parser target collecting text nodes of html, same text as BeautifulSoup get_text() gives"""
+
+    # strings inside of these tags are not NavigableString for BeautifulSoup, get_text() skips them
+    SKIPPED_TAGS = frozenset(('script', 'style', 'template', 'rt', 'rp'))
+    PRESERVE_WHITESPACE_TAGS = frozenset(('pre', 'textarea'))
+    ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+    def __init__(self):
+        self.skip_depth = 0
+        self.preserve_depth = 0
+        self.body_depth = 0
+        self.has_body = False
+        self.parts = []
+        self.body_parts = []
+        self.pending = []
+
+    def _end_data(self) -> None:
+        """Data between two tags or comments is one string, whitespace only strings are collapsed"""
+        if not self.pending:
+            return
+        text, self.pending = ''.join(self.pending), []
+        if self.skip_depth:
+            return
+        if not self.preserve_depth and not text.strip(self.ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+        self.parts.append(text)
+        if self.body_depth:
+            self.body_parts.append(text)
+
+    def start(self, tag, attrib):
+        self._end_data()
+        if tag in self.SKIPPED_TAGS:
+            self.skip_depth += 1
+        if tag in self.PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth += 1
+        if tag == 'body' and (self.body_depth or not self.has_body):
+            self.has_body = True
+            self.body_depth += 1
+
+    def end(self, tag):
+        self._end_data()
+        if tag in self.SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        if tag in self.PRESERVE_WHITESPACE_TAGS and self.preserve_depth:
+            self.preserve_depth -= 1
+        if tag == 'body' and self.body_depth:
+            self.body_depth -= 1
+
+    def data(self, content):
+        self.pending.append(content)
+
+    def comment(self, text):
+        self._end_data()
+
+    def doctype(self, *args):
+        self._end_data()
+
+    def pi(self, *args):
+        self._end_data()
+
+    def close(self):
+        self._end_data()
+        return self
+
+
+def is_plain_text(content: str) -> bool:
+    """Text without tags, entities and characters lxml normalizes is the same before and after html parsing"""
+    return MARKUP_CHARACTERS.isdisjoint(content)
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _extract_text(content: str, body_only: bool) -> str:
+    parser = etree.HTMLParser(target=_TextTarget(), recover=True)
+    # BeautifulSoup drops byte order mark of unicode markup before parsing
+    parser.feed(content[1:] if content.startswith('\ufeff') else content)
+    text = parser.close()
+    return ''.join(text.body_parts if body_only and text.has_body else text.parts).strip()
+
+
+def html_to_text(content: str, body_only: bool = False) -> str:
+    """
+    Get stripped plain text of html description
+    @body_only - text of <body> only, for full html documents like outlook sends
+    """
+    if not content:
+        return ''
+    if is_plain_text(content):
+        return content.strip()
+    return _extract_text(content, body_only)
@@ -0,0 +1,156 @@
+"""Local imitation of google calendar and microsoft graph apis for tests and benchmarks (events.benchmarks)
+
+    with FakeCalendarProvider(google_events=items, page_size=100, latency=0.05) as provider:
+        with override_settings(GOOGLE_CALENDAR_API_URL=provider.url, MS_GRAPH_API_URL=provider.url):
+            sync_google_events.apply(args=(social_id,))
+"""
+
+import json
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+EXPIRED_SYNC_TOKEN = 'expired'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.provider.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status_code: int, payload: dict = None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _handle(self, method: str):
+        provider = self.server.provider
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        provider.requests.append((method, url.path, query))
+        if provider.latency:
+            time.sleep(provider.latency)
+
+        route = provider.routes.get((method, url.path))
+        if route is None and method == 'DELETE' and url.path.startswith('/v1.0/subscriptions/'):
+            route = provider.delete_outlook_subscription
+        if route is None:
+            return self._send(HTTPStatus.NOT_FOUND, {'error': 'not found'})
+        status_code, payload = route(query, self._read_json() if method == 'POST' else {})
+        self._send(status_code, payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakeCalendarProvider:
+    """
+    Threaded http server answering like google calendar and microsoft graph
+    @google_events, @outlook_events - resources returned by list/delta endpoints, split by @page_size
+    @latency - seconds to wait before every answer, imitates network round trip
+    """
+
+    def __init__(self, google_events=(), outlook_events=(), page_size: int = 250, latency: float = 0.0,
+                 time_zone: str = 'UTC'):
+        self.google_events = list(google_events)
+        self.outlook_events = list(outlook_events)
+        self.page_size = page_size
+        self.latency = latency
+        self.time_zone = time_zone
+
+        self.requests = []
+        self.connections = 0
+        self.url = None
+
+        self.routes = {
+            ('GET', '/calendar/v3/calendars/primary/events'): self.list_google_events,
+            ('POST', '/calendar/v3/calendars/primary/events/watch'): self.watch_google_events,
+            ('POST', '/calendar/v3/channels/stop'): self.stop_google_channel,
+            ('GET', '/v1.0/me/calendarView/delta'): self.outlook_delta,
+            ('POST', '/v1.0/subscriptions'): self.create_outlook_subscription,
+        }
+
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.provider = self
+        host, port = self._server.server_address
+        self.url = f'http://{host}:{port}'
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _page(self, items: list, offset: int):
+        return items[offset:offset + self.page_size], offset + self.page_size < len(items)
+
+    def list_google_events(self, query: dict, data: dict):
+        if query.get('syncToken') == EXPIRED_SYNC_TOKEN:
+            return HTTPStatus.GONE, {'error': {'errors': [{'reason': 'fullSyncRequired'}]}}
+
+        if query.get('syncToken'):
+            # nothing changed since last sync
+            return HTTPStatus.OK, {'items': [], 'timeZone': self.time_zone, 'nextSyncToken': query['syncToken']}
+
+        offset = int(query.get('pageToken', 0))
+        items, has_more = self._page(self.google_events, offset)
+        result = {'items': items, 'timeZone': self.time_zone}
+        if has_more:
+            result['nextPageToken'] = str(offset + self.page_size)
+        else:
+            result['nextSyncToken'] = str(uuid4())
+        return HTTPStatus.OK, result
+
+    def watch_google_events(self, query: dict, data: dict):
+        return HTTPStatus.OK, {'id': data.get('id'), 'resourceId': str(uuid4())}
+
+    def stop_google_channel(self, query: dict, data: dict):
+        return HTTPStatus.OK, {}
+
+    def outlook_delta(self, query: dict, data: dict):
+        delta_link = f'{self.url}/v1.0/me/calendarView/delta?$deltatoken={uuid4()}'
+        if '$deltatoken' in query:
+            return HTTPStatus.OK, {'value': [], '@odata.deltaLink': delta_link}
+
+        offset = int(query.get('$skiptoken', 0))
+        items, has_more = self._page(self.outlook_events, offset)
+        result = {'value': items}
+        if has_more:
+            result['@odata.nextLink'] = f'{self.url}/v1.0/me/calendarView/delta?$skiptoken={offset + self.page_size}'
+        else:
+            result['@odata.deltaLink'] = delta_link
+        return HTTPStatus.OK, result
+
+    def create_outlook_subscription(self, query: dict, data: dict):
+        return HTTPStatus.CREATED, {'id': str(uuid4())}
+
+    def delete_outlook_subscription(self, query: dict, data: dict):
+        return HTTPStatus.NO_CONTENT, None
@@ -0,0 +1,28 @@
+"""Local storage with bulk deletion like S3 has, for tests
+
+    with override_settings(DEFAULT_FILE_STORAGE='events.fake_storage.BulkDeleteFileSystemStorage',
+                           MEDIA_ROOT=tmp_dir):
+        ...
+"""
+
+from typing import List
+
+from django.core.files.storage import FileSystemStorage
+
+
+class BulkDeleteFileSystemStorage(FileSystemStorage):
+    """File system storage which deletes many files with one call and remembers the calls"""
+
+    # names passed to each delete_many call
+    bulk_deletes = []
+    # names delete_many refuses to delete, as S3 reports them in Errors
+    failing_names = set()
+
+    def delete_many(self, names: List[str]) -> List[str]:
+        """Delete files, return names which failed"""
+        self.bulk_deletes.append(list(names))
+        failed = [name for name in names if name in self.failing_names]
+        for name in names:
+            if name not in self.failing_names:
+                self.delete(name)
+        return failed
@@ -0,0 +1,137 @@
+"""Numbers of viewer's friends attending events
+
+FriendAttendanceCount keeps (viewer, event) -> number of viewer's friends attending event, so a page of events
+gets the numbers with one indexed lookup instead of a friends subquery per event. Rows are changed with a few
+queries per attendance or friendship change, however many friends and events it touches. Friendship is read
+through user.friends only, so signals check it before and after subscriptions of users change and call
+friendship_created/friendship_removed when it did.
+rebuild_viewer recounts rows of a viewer from scratch, for backfill.
+"""
+
+from collections import Counter, defaultdict
+from typing import Collection, Dict, Iterable, Tuple
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from events.models import Attendance, FriendAttendanceCount
+
+User = get_user_model()
+
+# (viewer ids, event ids, delta), delta is added to count of every (viewer, event) pair of them
+CountsChange = Tuple[Collection[int], Collection[int], int]
+
+
+def _add_counts(changes: Iterable[CountsChange]) -> None:
+    """
+    Add deltas to counts, rows which don't exist yet are created first
+    Upsert is done with one insert of missing rows and one F() update per change, ON CONFLICT DO UPDATE is not
+    available to bulk_create of this django version.
+    """
+    changes = [(viewer_ids, event_ids, delta) for viewer_ids, event_ids, delta in changes
+               if viewer_ids and event_ids and delta]
+    if not changes:
+        return
+
+    FriendAttendanceCount.objects.bulk_create([
+        FriendAttendanceCount(viewer_id=viewer_id, event_id=event_id)
+        for viewer_ids, event_ids, _ in changes for viewer_id in viewer_ids for event_id in event_ids
+    ], ignore_conflicts=True)
+    for viewer_ids, event_ids, delta in changes:
+        FriendAttendanceCount.objects.filter(viewer_id__in=viewer_ids, event_id__in=event_ids).update(
+            count=F('count') + delta
+        )
+
+
+def attendance_changed(user: User, event_ids: Iterable[int], delta: int) -> None:
+    """User started (delta=1) or stopped (delta=-1) attending events, change counts of all their friends"""
+    event_ids = list(event_ids)
+    if not event_ids or not delta:
+        return
+
+    if delta > 0:
+        _add_counts([(list(user.friends.values_list('id', flat=True)), event_ids, delta)])
+    else:
+        # rows of attended events exist already
+        FriendAttendanceCount.objects.filter(
+            event_id__in=event_ids, viewer_id__in=user.friends.values('id')
+        ).update(count=F('count') + delta)
+
+
+def users_attended(users: Iterable[User], event_id: int) -> None:
+    """Users started attending event, change counts of all their friends with a few queries"""
+    friends = [user.friends.values_list('id', flat=True).order_by() for user in users]
+    if not friends:
+        return
+
+    # friend of a few of users gets all of them counted at once, friends are grouped by that number
+    counts = Counter(friends[0].union(*friends[1:], all=True) if len(friends) > 1 else friends[0])
+    viewers_by_count = defaultdict(list)
+    for viewer_id, count in counts.items():
+        viewers_by_count[count].append(viewer_id)
+    _add_counts((viewer_ids, [event_id], count) for count, viewer_ids in viewers_by_count.items())
+
+
+def _friendship_changed(user_id: int, friend_id: int, delta: int) -> None:
+    """Each of users gets counts of events the other one attends changed by delta"""
+    if delta > 0:
+        attended = defaultdict(list)
+        for attendee_id, event_id in Attendance.objects.filter(
+            user_id__in=(user_id, friend_id), status=Attendance.ATTENDING
+        ).values_list('user_id', 'event_id'):
+            attended[attendee_id].append(event_id)
+        _add_counts([([friend_id], attended[user_id], delta), ([user_id], attended[friend_id], delta)])
+    else:
+        def attended(attendee_id):
+            return Attendance.objects.filter(user_id=attendee_id, status=Attendance.ATTENDING).values('event_id')
+
+        FriendAttendanceCount.objects.filter(
+            Q(viewer_id=friend_id, event_id__in=attended(user_id)) |
+            Q(viewer_id=user_id, event_id__in=attended(friend_id))
+        ).update(count=F('count') + delta)
+
+
+def friendship_created(user_id: int, friend_id: int) -> None:
+    """Two users became friends"""
+    _friendship_changed(user_id, friend_id, 1)
+
+
+def friendship_removed(user_id: int, friend_id: int) -> None:
+    """Two users stopped being friends"""
+    _friendship_changed(user_id, friend_id, -1)
+
+
+def are_friends(user: User, other_id: int) -> bool:
+    return user.friends.filter(pk=other_id).exists()
+
+
+def friendship_checked(user: User, other_id: int, were_friends: bool) -> None:
+    """Change counts of both users if their friendship changed since it was checked"""
+    now_friends = are_friends(user, other_id)
+    if now_friends != were_friends:
+        (friendship_created if now_friends else friendship_removed)(user.id, other_id)
+
+
+def rebuild_viewer(viewer: User) -> None:
+    """Recount all rows of viewer from attendances of their friends"""
+    events_by_count = defaultdict(list)
+    for event_id, count in (
+        Attendance.objects.filter(user__in=viewer.friends, status=Attendance.ATTENDING)
+        .values('event_id').annotate(friends_count=Count('id')).order_by()
+        .values_list('event_id', 'friends_count')
+    ):
+        events_by_count[count].append(event_id)
+
+    with transaction.atomic():
+        FriendAttendanceCount.objects.filter(viewer=viewer).delete()
+        _add_counts(([viewer.id], event_ids, count) for count, event_ids in events_by_count.items())
+
+
+def get_counts(viewer: User, event_ids: Iterable[int]) -> Dict[int, int]:
+    """Numbers of viewer's friends attending events, with one query"""
+    event_ids = list(event_ids)
+    counts = dict(
+        FriendAttendanceCount.objects.filter(viewer=viewer, event_id__in=event_ids).values_list('event_id', 'count')
+    )
+    return {event_id: counts.get(event_id, 0) for event_id in event_ids}
@@ -0,0 +1,23 @@
+"""Middlewares of event app
+
+Counter changes of a request are batched only when CounterBatchMiddleware is listed in project settings,
+without it every change is written to cache on its own:
+
+    MIDDLEWARE = [
+        ...
+        'events.middleware.CounterBatchMiddleware',
+    ]
+"""
+
+from events import counters
+
+
+class CounterBatchMiddleware:
+    """Write event counter changes of the whole request at once"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with counters.batch():
+            return self.get_response(request)
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0031_auto_20200703_1324'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='sync_fingerprint',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2 on 2026-10-17 13:05
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0032_event_sync_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=128)),
+                ('kwargs', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
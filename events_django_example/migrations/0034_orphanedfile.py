@@ -0,0 +1,22 @@
+# Generated by Django 2.2 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0033_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrphanedFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,6 +1,7 @@
 """Event models"""
 
 from django.conf import settings
+from django.contrib.postgres.fields import JSONField
 from django.core.files.storage import default_storage
 from django.db import models
 from django.template.defaultfilters import truncatechars
@@ -90,6 +91,8 @@ class Event(ImageHandlerMixin, models.Model):
 
     provider = models.CharField(max_length=32, null=True, blank=True)
     external_id = models.CharField(max_length=255, null=True, db_index=True, blank=True)
+    # hash of synced provider payload, unchanged events are not rewritten on sync
+    sync_fingerprint = models.CharField(max_length=32, blank=True)
 
     attendees = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='attends', through='Attendance',
                                        through_fields=('event', 'user'))
@@ -169,11 +172,36 @@ class Attendance(models.Model):
     class Meta:
         unique_together = (('event', 'user'), )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember status as loaded, so saves know the old one without a query
+        if 'status' in field_names:
+            instance._loaded_status = values[field_names.index('status')]
+        return instance
+
     @property
     def status_cache_key(self):
         """Get cache key by current status"""
         return self.CACHE_STATUS_KEY_MAP[self.status]
 
+    def get_saved_status(self):
+        """Status stored in db, None for new attendance. Queried only if instance was not loaded from db"""
+        if self.pk is None:
+            return None
+        if hasattr(self, '_loaded_status'):
+            return self._loaded_status
+        return Attendance.objects.filter(pk=self.pk).values_list('status', flat=True).first()
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        if fields is None or 'status' in fields:
+            self.set_saved_status()
+
+    def set_saved_status(self):
+        """Remember current status as stored one, called after save"""
+        self._loaded_status = self.status
+
     def __str__(self):
         return f'Attendance of {self.user} to {self.event.title} ({self.status})'
 
@@ -256,3 +284,37 @@ class EventComment(models.Model):
 
     def __str__(self):
         return f'{self.user} in {self.event}: {truncatechars(self.body, 50)}'
+
+
+class NotificationOutbox(models.Model):
+    """Task message written in transaction of the change it's about, sent to broker by relay after commit"""
+    task = models.CharField(max_length=128)
+    kwargs = JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.task}({self.kwargs})'
+
+
+class OrphanedFile(models.Model):
+    """Storage file of deleted row, removed from storage by garbage collector in background"""
+    name = models.CharField(max_length=255)
+    # failed removals, rows stay until file is gone
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class FriendAttendanceCount(models.Model):
+    """Number of viewer's friends attending event, kept by events.friend_counts"""
+    viewer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    event = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='+')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('viewer', 'event'),)
+
+    def __str__(self):
+        return f'{self.count} friends of {self.viewer_id} attend event {self.event_id}'
@@ -0,0 +1,70 @@
+"""Transactional outbox of notification tasks
+
+Signal receivers don't talk to the broker. Task messages are written to NotificationOutbox in the transaction
+of the change, so rolled back changes send nothing and requests don't wait for the broker. A transaction which
+wrote messages starts one relay task once it is committed, the relay sends written messages in batches through
+one producer connection and deletes them, delivery is at least once. Beat runs the relay periodically as well,
+for messages whose relay was not started, e.g. by a process which died right after commit.
+"""
+
+from typing import Iterable
+
+from django.db import transaction
+
+from events.models import NotificationOutbox
+from prism.celery import app
+
+RELAY_BATCH_SIZE = 500
+
+
+def _start_relay() -> None:
+    from events.tasks import relay_notifications
+    relay_notifications.delay()
+
+
+def on_commit_once(func) -> None:
+    """Run func once current transaction is committed, once per transaction however many times it is called"""
+    connection = transaction.get_connection()
+    # callbacks of rolled back savepoints are dropped from run_on_commit, func is registered again then
+    if connection.in_atomic_block and any(callback is func for _, callback in connection.run_on_commit):
+        return
+    transaction.on_commit(func)
+
+
+def enqueue(task, **kwargs) -> None:
+    """Send task with kwargs once current transaction is committed"""
+    NotificationOutbox.objects.create(task=task.name, kwargs=kwargs)
+    on_commit_once(_start_relay)
+
+
+def enqueue_many(task, kwargs_list: Iterable[dict]) -> None:
+    """Send task once for each of kwargs, with one insert"""
+    messages = NotificationOutbox.objects.bulk_create([
+        NotificationOutbox(task=task.name, kwargs=kwargs) for kwargs in kwargs_list
+    ])
+    if messages:
+        on_commit_once(_start_relay)
+
+
+def relay(batch_size: int = RELAY_BATCH_SIZE) -> int:
+    """
+    Send written messages to broker, return number of sent messages
+    Rows locked by a concurrent relay are skipped, so relays can run at the same time.
+    """
+    sent = 0
+    while True:
+        with transaction.atomic():
+            messages = list(
+                NotificationOutbox.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
+            )
+            if not messages:
+                return sent
+
+            with app.producer_or_acquire() as producer:
+                for message in messages:
+                    app.send_task(message.task, kwargs=message.kwargs, producer=producer)
+            NotificationOutbox.objects.filter(id__in=[message.id for message in messages]).delete()
+
+        sent += len(messages)
+        if len(messages) < batch_size:
+            return sent
@@ -0,0 +1,66 @@
+"""Previews of event attendees and comments
+
+Viewer's friends go first in attendees preview, then everybody else, each part ordered by status. The friend
+mark is an EXISTS annotation, so one query gives a preview of one event and one ROW_NUMBER() query gives
+previews of a page. Latest comments of a page are taken with one ROW_NUMBER() query too, and attendance
+statuses of all their authors with one more.
+"""
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from django.db.models import Exists, OuterRef
+
+from events.models import Attendance, EventComment
+from events.queries import top_n_per_group
+
+PREVIEW_ORDERING = ('-is_friend', 'status', 'id')
+
+
+def _attendances_with_friend_mark(viewer):
+    return Attendance.objects.select_related('user', 'event').annotate(
+        is_friend=Exists(viewer.friends.filter(pk=OuterRef('user_id')))
+    )
+
+
+def attendance_preview(viewer, event_id: int, count: int) -> List[Attendance]:
+    """First attendances of event, viewer's friends first"""
+    return list(_attendances_with_friend_mark(viewer).filter(event_id=event_id).order_by(*PREVIEW_ORDERING)[:count])
+
+
+def attendance_previews(viewer, event_ids: Iterable[int], count: int) -> Dict[int, List[Attendance]]:
+    """First attendances of each of events, viewer's friends first, with one query"""
+    event_ids = list(event_ids)
+    attendances = _attendances_with_friend_mark(viewer).filter(event_id__in=event_ids)
+    previews = defaultdict(list)
+    for attendance in top_n_per_group(attendances, 'event_id', PREVIEW_ORDERING, count).order_by(
+            'event_id', *PREVIEW_ORDERING):
+        previews[attendance.event_id].append(attendance)
+    return {event_id: previews[event_id] for event_id in event_ids}
+
+
+def comments_previews(event_ids: Iterable[int], count: int) -> Tuple[Dict[int, list], Dict[int, Dict[int, int]]]:
+    """
+    Latest comments of each of events, newest first, with one query
+    and attendance statuses of their authors in each event (event id -> user id -> status) with another one
+    """
+    event_ids = list(event_ids)
+    comments = defaultdict(list)
+    latest = top_n_per_group(EventComment.objects.filter(event_id__in=event_ids), 'event_id', ('-id',), count)
+    for comment in latest.select_related('user').order_by('event_id', '-id'):
+        comments[comment.event_id].append(comment)
+
+    authors = {(comment.event_id, comment.user_id) for event_comments in comments.values()
+               for comment in event_comments}
+    statuses = defaultdict(dict)
+    if authors:
+        for event_id, user_id, status in Attendance.objects.filter(
+            event_id__in=event_ids, user_id__in={user_id for _, user_id in authors}
+        ).values_list('event_id', 'user_id', 'status'):
+            if (event_id, user_id) in authors:
+                statuses[event_id][user_id] = status
+
+    return (
+        {event_id: comments[event_id] for event_id in event_ids},
+        {event_id: statuses[event_id] for event_id in event_ids},
+    )
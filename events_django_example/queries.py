@@ -0,0 +1,39 @@
+"""Query helpers shared by event app"""
+
+from typing import Sequence
+
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+RANK_ALIAS = 'rank_in_group'
+
+
+def _ordering_expression(ordering):
+    if isinstance(ordering, str):
+        return F(ordering[1:]).desc() if ordering.startswith('-') else F(ordering).asc()
+    return ordering
+
+
+def top_n_per_group(queryset, group_by: str, order_by: Sequence, n: int):
+    """
+    Filter queryset to first n rows of each group_by value in order_by order, with one ROW_NUMBER() query
+    order_by takes field names, '-' prefixed for descending, annotations of queryset or expressions.
+    Result is not ordered, order it as needed.
+    """
+    ranked = queryset.annotate(**{RANK_ALIAS: Window(
+        expression=RowNumber(),
+        partition_by=[F(group_by)],
+        order_by=[_ordering_expression(ordering) for ordering in order_by],
+    )}).values('pk', RANK_ALIAS).order_by()
+    sql, params = ranked.query.sql_with_params()
+    pk_column = queryset.model._meta.pk.column
+    # raw SQL: django can't filter on a window function, the ranked query is wrapped in a subquery instead
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT ranked.{pk_column} FROM ({sql}) ranked WHERE ranked.{RANK_ALIAS} <= %s', (*params, n)
+    ))
+
+
+def raw_delete(queryset) -> int:
+    """Delete rows with one query, without collecting them and sending delete signals, return number of rows"""
+    return queryset._raw_delete(queryset.db)
@@ -0,0 +1,61 @@
+"""Reminders of attendances
+
+Reminder follows attendance status: attending and maybe users have one, declined and removed ones don't, pending
+invites are left as they are. Transitions of many attendances are applied with one read of existing reminders,
+one insert and one delete, notifications of created/removed reminders are written to outbox in one insert each.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from events import outbox
+from events.models import Attendance, Reminder
+from events.queries import raw_delete
+from notifications.tasks import (create_reminder_notification,
+                                 remove_reminder_notification)
+
+# (user id, event id, new attendance status), status is None for removed attendance
+Transition = Tuple[int, int, Optional[int]]
+
+REMINDED_STATUSES = (Attendance.ATTENDING, Attendance.MAYBE)
+UNREMINDED_STATUSES = (Attendance.DECLINED, None)
+
+
+def _existing(pairs: List[Tuple[int, int]]) -> Dict[Tuple[int, int], int]:
+    """Ids of reminders of (user id, event id) pairs, read with one query"""
+    wanted = set(pairs)
+    rows = Reminder.objects.filter(
+        user_id__in={user_id for user_id, _ in wanted}, event_id__in={event_id for _, event_id in wanted}
+    ).values_list('user_id', 'event_id', 'id')
+    return {(user_id, event_id): reminder_id for user_id, event_id, reminder_id in rows
+            if (user_id, event_id) in wanted}
+
+
+def sync_reminders(transitions: Iterable[Transition]) -> None:
+    """
+    Create/delete reminders for attendance transitions and schedule their notifications
+    Rows are written without Reminder signals, notifications are what post_save/post_delete receivers would send.
+    Last transition of (user, event) wins.
+    """
+    statuses = {(user_id, event_id): status for user_id, event_id, status in transitions}
+    existing = _existing([pair for pair, status in statuses.items()
+                          if status in REMINDED_STATUSES or status in UNREMINDED_STATUSES])
+    to_create = [pair for pair, status in statuses.items() if status in REMINDED_STATUSES and pair not in existing]
+    to_delete = {pair: existing[pair] for pair, status in statuses.items()
+                 if status in UNREMINDED_STATUSES and pair in existing}
+
+    # a reminder created or deleted concurrently after the read is skipped by ignore_conflicts/the delete but is
+    # still notified here, so such a pair may get its notification twice
+    if to_create:
+        offset = Reminder._meta.get_field('offset').get_default()
+        Reminder.objects.bulk_create([Reminder(user_id=user_id, event_id=event_id, offset=offset)
+                                      for user_id, event_id in to_create], ignore_conflicts=True)
+        outbox.enqueue_many(create_reminder_notification, [
+            {'recipient_id': user_id, 'target_id': event_id, 'reminder_offset': offset}
+            for user_id, event_id in to_create
+        ])
+
+    if to_delete:
+        raw_delete(Reminder.objects.filter(id__in=list(to_delete.values())))
+        outbox.enqueue_many(remove_reminder_notification, [
+            {'recipient_id': user_id, 'target_id': event_id} for user_id, event_id in to_delete
+        ])
@@ -0,0 +1,141 @@
+"""Scheduling of calendar syncs
+
+Providers push a notification for every change, so a burst of pushes for one account is coalesced into one sync
+started after a debounce window. Accounts are spread over sharded worker queues and number of syncs running
+against one provider at once is capped to stay inside of its rate limits. One account is synced by one worker
+at a time, a sync scheduled while another one runs waits for it and stays the pending sync of account meanwhile.
+"""
+
+from contextlib import contextmanager
+from typing import Optional
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+# seconds to wait for more notifications before sync starts
+DEFAULT_DEBOUNCE = 5
+# pending mark outlives debounce window, so a lost task doesn't block syncs of account forever
+PENDING_GRACE = 60
+# syncs running against one provider at once
+DEFAULT_PROVIDER_CONCURRENCY = 20
+# seconds to wait before trying again when provider has no free slots
+PROVIDER_BUSY_RETRY = 10
+# slots of crashed workers are released when counter expires
+SLOTS_TTL = 60 * 60
+# running lock of crashed worker is released when it expires, must be longer than the longest sync
+DEFAULT_RUNNING_TTL = 60 * 30
+
+PENDING_KEY = 'calendar_sync_pending_{}'
+SLOTS_KEY = 'calendar_sync_slots_{}'
+RUNNING_KEY = 'calendar_sync_running_{}'
+
+
+class ProviderBusy(Exception):
+    """All sync slots of provider are taken"""
+
+
+class SyncRunning(Exception):
+    """Another sync of account is running"""
+
+
+def shard_queue(social_id: int) -> Optional[str]:
+    """Worker queue of account, None is the default queue when sharding is off"""
+    shards = getattr(settings, 'CALENDAR_SYNC_SHARDS', 0)
+    if not shards:
+        return None
+    return f'calendar_sync_{social_id % shards}'
+
+
+def schedule_sync(social_id: int, provider: str) -> bool:
+    """
+    Enqueue sync of account unless one is already waiting to start
+    Return True if new sync was enqueued
+    """
+    from events.tasks import sync_google_events, sync_outlook_events
+    sync_tasks = {
+        'google-oauth2': sync_google_events,
+        'microsoft-graph': sync_outlook_events,
+    }
+
+    debounce = getattr(settings, 'CALENDAR_SYNC_DEBOUNCE', DEFAULT_DEBOUNCE)
+    if not cache.add(PENDING_KEY.format(social_id), True, timeout=debounce + PENDING_GRACE):
+        return False
+
+    sync_tasks[provider].apply_async(args=(social_id,), countdown=debounce, queue=shard_queue(social_id))
+    return True
+
+
+def clear_pending_sync(social_id: int) -> None:
+    """Called when sync starts, notifications coming after this point need one more sync"""
+    cache.delete(PENDING_KEY.format(social_id))
+
+
+def refresh_pending_sync(social_id: int) -> None:
+    """Called when sync is retried later, it stays the pending one and no duplicates are enqueued meanwhile"""
+    cache.set(PENDING_KEY.format(social_id), True, timeout=PROVIDER_BUSY_RETRY + PENDING_GRACE)
+
+
+def acquire_running_lock(social_id: int) -> Optional[str]:
+    """Token of taken running lock of account, None if another sync of account holds it"""
+    token = uuid4().hex
+    timeout = getattr(settings, 'CALENDAR_SYNC_RUNNING_TTL', DEFAULT_RUNNING_TTL)
+    return token if cache.add(RUNNING_KEY.format(social_id), token, timeout=timeout) else None
+
+
+def release_running_lock(social_id: int, token: str) -> None:
+    """Release running lock unless it expired and was taken by another sync"""
+    key = RUNNING_KEY.format(social_id)
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+@contextmanager
+def running_sync(social_id: int):
+    """Hold running lock of account for the block, raises SyncRunning if another sync of account holds it"""
+    token = acquire_running_lock(social_id)
+    if token is None:
+        raise SyncRunning(social_id)
+    try:
+        yield
+    finally:
+        release_running_lock(social_id, token)
+
+
+def _provider_concurrency(provider: str) -> int:
+    return getattr(settings, 'CALENDAR_SYNC_PROVIDER_CONCURRENCY', {}).get(provider, DEFAULT_PROVIDER_CONCURRENCY)
+
+
+def acquire_provider_slot(provider: str) -> bool:
+    """Take one of provider sync slots, False if there are no free slots"""
+    key = SLOTS_KEY.format(provider)
+    cache.add(key, 0, timeout=SLOTS_TTL)
+    try:
+        taken = cache.incr(key)
+    except ValueError:
+        # counter expired right after add
+        cache.add(key, 1, timeout=SLOTS_TTL)
+        taken = 1
+
+    if taken > _provider_concurrency(provider):
+        cache.decr(key)
+        return False
+    return True
+
+
+def release_provider_slot(provider: str) -> None:
+    try:
+        cache.decr(SLOTS_KEY.format(provider))
+    except ValueError:
+        pass
+
+
+@contextmanager
+def provider_slot(provider: str):
+    """Take one of provider sync slots for the block, raises ProviderBusy if there are no free slots"""
+    if not acquire_provider_slot(provider):
+        raise ProviderBusy(provider)
+    try:
+        yield
+    finally:
+        release_provider_slot(provider)
@@ -0,0 +1,261 @@
+"""Bulk operations for event app
+
+Signals in this app are written for single row saves. The functions below work on whole sets of rows
+and reproduce the side effects of those signals in bulk, so callers must not rely on post_save/post_delete
+receivers firing for the rows they touch.
+"""
+
+import hashlib
+import json
+from typing import Dict, Iterable, List
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from events import counters, friend_counts, outbox
+from events.models import (Attendance, Event, EventComment, EventImage,
+                           EventInvite, EventLike, FriendAttendanceCount,
+                           Reminder)
+from events.queries import raw_delete
+from events.reminders import sync_reminders
+from events.storage_gc import record_orphans
+from notifications.tasks import (create_event_invite_user_notification,
+                                 remove_event_invite_user_notification,
+                                 remove_event_like_notification,
+                                 remove_reminder_notification)
+
+User = get_user_model()
+
+# fields that are filled from provider payloads on sync
+SYNCED_EVENT_FIELDS = ('title', 'description', 'start', 'end', 'start_timezone', 'end_timezone')
+
+
+def schedule_subscribers_attendance(event: Event) -> None:
+    """Create attendances of creator subscribers in background once event is committed"""
+    from events.tasks import create_attendance_for_subscribers
+    transaction.on_commit(lambda: create_attendance_for_subscribers.delay(event.id, event.user_id))
+
+
+def event_fingerprint(values: dict) -> str:
+    """Hash of normalized provider values of event"""
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def bulk_create_events(events: List[Event]) -> List[Event]:
+    """
+    Create events with one insert and do what post_create_event_handler does for each of them:
+    creator attendance, events counter of creator, attending friends counts of creator's friends,
+    attendances for subscribers of public events
+    Primary keys of created events are required, so this relies on a backend that returns them (postgres)
+    """
+    if not events:
+        return []
+
+    with transaction.atomic():
+        created = Event.objects.bulk_create(events)
+        Attendance.objects.bulk_create([
+            Attendance(event_id=event.id, user_id=event.user_id, status=Attendance.ATTENDING)
+            for event in created
+        ])
+        owners = {event.user_id: event.user for event in created}
+        for user_id, owner in owners.items():
+            friend_counts.attendance_changed(owner, [event.id for event in created if event.user_id == user_id], 1)
+
+    # a page almost always belongs to one owner, subscribers are checked once per owner
+    public_owner_ids = {event.user_id for event in created if not event.is_private}
+    owners_with_subscribers = {user_id for user_id in public_owner_ids if owners[user_id].subscribers.exists()}
+    for event in created:
+        counters.incr(User, event.user_id, 'events')
+        counters.incr(Event, event.id, Attendance.CACHE_STATUS_KEY_MAP[Attendance.ATTENDING])
+        if not event.is_private and event.user_id in owners_with_subscribers:
+            schedule_subscribers_attendance(event)
+
+    return created
+
+
+def sync_events_page(user: User, provider: str, upserts: Dict[str, dict], removed_ids: Iterable[str]) -> None:
+    """
+    Apply one page of provider events for user
+
+    @upserts - external id -> model field values of event
+    @removed_ids - external ids of events cancelled/removed on provider side
+
+    Existing events are loaded with one query, then changed with one bulk_update and new ones are created
+    with one bulk_create. Events which values are the same as on previous sync are not written at all.
+    Removed events are deleted with one queryset delete.
+    """
+    removed_ids = set(removed_ids) - set(upserts)
+
+    if removed_ids:
+        delete_events(Event.objects.filter(user=user, provider=provider, external_id__in=removed_ids))
+
+    if not upserts:
+        return
+
+    existing = {
+        event.external_id: event
+        for event in Event.objects.filter(
+            user=user, provider=provider, external_id__in=list(upserts)
+        ).only('id', 'external_id', 'sync_fingerprint')
+    }
+
+    to_create, to_update = [], []
+    now = timezone.now()
+    for external_id, values in upserts.items():
+        fingerprint = event_fingerprint(values)
+        event = existing.get(external_id)
+        if event is None:
+            to_create.append(Event(user=user, provider=provider, external_id=external_id,
+                                   sync_fingerprint=fingerprint, **values))
+        elif event.sync_fingerprint != fingerprint:
+            for field, value in values.items():
+                setattr(event, field, value)
+            event.sync_fingerprint = fingerprint
+            # auto_now is not applied by bulk_update
+            event.updated = now
+            to_update.append(event)
+
+    if to_update:
+        Event.objects.bulk_update(to_update, fields=[*SYNCED_EVENT_FIELDS, 'sync_fingerprint', 'updated'])
+
+    bulk_create_events(to_create)
+
+
+def _insert_subscription_attendances(event_id: int, user_ids: List[int]) -> List[int]:
+    """Insert attending attendances of subscribers, return ids of users who had none and really got one"""
+    attendances = Attendance.objects.bulk_create([
+        Attendance(event_id=event_id, user_id=user_id, status=Attendance.ATTENDING, is_from_subscription=True)
+        for user_id in dict.fromkeys(user_ids)
+    ], ignore_conflicts=True)
+    # ignore_conflicts returns every object, inserted or not, rows which kept their creation time from
+    # auto_now_add of this insert are the inserted ones
+    created = {attendance.user_id: attendance.created for attendance in attendances}
+    inserted = {
+        user_id for user_id, created_at in Attendance.objects.filter(
+            event_id=event_id, user_id__in=list(created)
+        ).values_list('user_id', 'created')
+        if created[user_id] == created_at
+    }
+    return [user_id for user_id in created if user_id in inserted]
+
+
+def bulk_attend_from_subscription(event_id: int, user_ids: List[int]) -> List[int]:
+    """
+    Make subscribers attend event with a few bulk queries instead of one Attendance.objects.create per user
+    Does what attendance signals would: attending counter, reminders and reminder notifications, only for users
+    whose attendance was really inserted, users who already have one (even set concurrently) are left as they are.
+    Friend attendance counts are left to caller.
+    Return ids of users who got attendance.
+    """
+    with transaction.atomic():
+        new_user_ids = _insert_subscription_attendances(event_id, user_ids)
+        if not new_user_ids:
+            return []
+        sync_reminders((user_id, event_id, Attendance.ATTENDING) for user_id in new_user_ids)
+
+    counters.incr(Event, event_id, Attendance.CACHE_STATUS_KEY_MAP[Attendance.ATTENDING], len(new_user_ids))
+    return new_user_ids
+
+
+def bulk_invite(event: Event, inviter: User, invitee_ids: List[int]) -> List[EventInvite]:
+    """
+    Invite users with a few bulk queries instead of one EventInvite.objects.create per user
+    Does what invite and attendance signals would: pending attendances, pending counter and invite notifications.
+    Invitees must not attend event yet. Primary keys of attendances are required (postgres).
+    """
+    if not invitee_ids:
+        return []
+
+    with transaction.atomic():
+        attendances = Attendance.objects.bulk_create([
+            Attendance(event_id=event.id, user_id=user_id, status=Attendance.INVITE_PENDING)
+            for user_id in invitee_ids
+        ])
+        invites = EventInvite.objects.bulk_create([
+            EventInvite(event_id=event.id, inviter_id=inviter.id, invitee_id=attendance.user_id,
+                        invitee_attendance_id=attendance.id)
+            for attendance in attendances
+        ])
+        outbox.enqueue_many(create_event_invite_user_notification, [
+            {'target_id': event.id, 'actor_id': inviter.id, 'recipient_id': user_id} for user_id in invitee_ids
+        ])
+
+    counters.incr(Event, event.id, Attendance.CACHE_STATUS_KEY_MAP[Attendance.INVITE_PENDING], len(invitee_ids))
+    return invites
+
+
+def bulk_uninvite(event: Event, user_ids: List[int], inviter: User = None) -> int:
+    """
+    Drop pending invites of users with set queries instead of loading every attendance for delete()
+    Does what attendance/invite delete signals would: pending counter, reminders and invite notification removals.
+    @inviter - drop only invites sent by this user
+    Return number of dropped invites.
+    """
+    attendances = Attendance.objects.filter(event_id=event.id, user_id__in=user_ids,
+                                            status=Attendance.INVITE_PENDING)
+    if inviter is not None:
+        attendances = attendances.filter(invite__inviter_id=inviter.id)
+
+    with transaction.atomic():
+        rows = list(attendances.select_for_update(of=('self',)).values_list('id', 'user_id', 'invite__inviter_id'))
+        if not rows:
+            return 0
+
+        attendance_ids = [attendance_id for attendance_id, _, _ in rows]
+        raw_delete(EventInvite.objects.filter(invitee_attendance_id__in=attendance_ids))
+        sync_reminders((user_id, event.id, None) for _, user_id, _ in rows)
+        raw_delete(Attendance.objects.filter(id__in=attendance_ids))
+
+        outbox.enqueue_many(remove_event_invite_user_notification, [
+            {'target_id': event.id, 'actor_id': inviter_id, 'recipient_id': user_id}
+            for _, user_id, inviter_id in rows if inviter_id is not None
+        ])
+
+    counters.decr(Event, event.id, Attendance.CACHE_STATUS_KEY_MAP[Attendance.INVITE_PENDING], len(rows))
+    return len(rows)
+
+
+def delete_events(events) -> int:
+    """
+    Delete events of queryset without per-row delete signals of their children
+    Attendances, invites, reminders, likes, comments, images and friend counts are deleted with one query
+    each. Cached counters are dropped at once, notification removals and image files are handed to background
+    through outbox and storage garbage collector. Relations of other apps are left to Event.delete() collector.
+    Return number of deleted events.
+    """
+    with transaction.atomic():
+        event_ids = list(events.select_for_update().values_list('id', flat=True))
+        if not event_ids:
+            return 0
+
+        likes = EventLike.objects.filter(event_id__in=event_ids).exclude(user_id=F('event__user_id'))
+        outbox.enqueue_many(remove_event_like_notification, [
+            {'actor_id': user_id, 'target_id': event_id, 'recipient_id': owner_id}
+            for user_id, event_id, owner_id in likes.values_list('user_id', 'event_id', 'event__user_id')
+        ])
+        invites = EventInvite.objects.filter(event_id__in=event_ids,
+                                             invitee_attendance__status=Attendance.INVITE_PENDING)
+        outbox.enqueue_many(remove_event_invite_user_notification, [
+            {'target_id': event_id, 'actor_id': inviter_id, 'recipient_id': invitee_id}
+            for event_id, inviter_id, invitee_id in invites.values_list('event_id', 'inviter_id', 'invitee_id')
+        ])
+        reminders = Reminder.objects.filter(event_id__in=event_ids)
+        outbox.enqueue_many(remove_reminder_notification, [
+            {'recipient_id': user_id, 'target_id': event_id}
+            for user_id, event_id in reminders.values_list('user_id', 'event_id')
+        ])
+        record_orphans(EventImage.objects.filter(event_id__in=event_ids).values_list('image', flat=True))
+
+        # children first, invites reference attendances
+        for model in (EventInvite, Reminder, Attendance, EventLike, EventComment, EventImage,
+                      FriendAttendanceCount):
+            raw_delete(model.objects.filter(event_id__in=event_ids))
+
+        # remaining relations and post_delete of events themselves
+        Event.objects.filter(id__in=event_ids).delete()
+
+    counters.drop(event_ids)
+    return len(event_ids)
@@ -1,28 +1,32 @@
 """Signals for event app"""
 
 from django.contrib.auth import get_user_model
-from django.db import transaction
-from django.db.models.signals import post_delete, post_save, pre_save
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete, pre_save)
 from django.dispatch import receiver
 
+from events import counters, friend_counts, outbox
 from events.models import (Attendance, Event, EventComment, EventImage,
                            EventInvite, EventLike, Reminder)
-from events.tasks import create_attendance_for_subscribers
+from events.reminders import sync_reminders
+from events.services import schedule_subscribers_attendance
+from events.storage_gc import record_orphans
+from events.subscriptions import invalidate_on_commit
 from notifications.tasks import (create_event_invite_user_notification,
                                  create_event_like_notification,
                                  create_reminder_notification,
                                  remove_event_invite_user_notification,
                                  remove_event_like_notification,
                                  remove_reminder_notification)
-from prism.utils.cache_utils import decr_in_cache, incr_in_cache
+from users.models import Subscription, UserSocialAuth
 
 User = get_user_model()
 
 
 @receiver(post_delete, sender=EventImage)
 def auto_delete_file_on_delete(sender, instance, **kwargs) -> None:
-    """Dropping all images saved to storage any sizes"""
-    instance.drop_all_images()
+    """Dropping all images saved to storage any sizes, in background after commit"""
+    record_orphans([instance.image.name])
 
 
 @receiver(post_save, sender=Event)
@@ -32,16 +36,16 @@ def post_create_event_handler(sender, instance: Event, created, **kwargs) -> Non
         # add attendance for event
         Attendance.objects.create(event=instance, user=instance.user, status=Attendance.ATTENDING)
         # increment events counter for user if exist
-        incr_in_cache(User, instance.user_id, 'events')
+        counters.incr(User, instance.user_id, 'events')
         # create attendance for subscribers
         if not instance.is_private and instance.user.subscribers.exists():
-            create_attendance_for_subscribers(instance.id, instance.user_id)
+            schedule_subscribers_attendance(instance)
 
 
 @receiver(post_delete, sender=Event)
 def post_delete_event_handler(sender, instance: Event, **kwargs) -> None:
     """Decrement events counter for user"""
-    decr_in_cache(User, instance.user_id, 'events')
+    counters.decr(User, instance.user_id, 'events')
 
 
 @receiver(pre_save, sender=EventInvite)
@@ -56,8 +60,8 @@ def pre_save_create_attendance_for_invite(sender, instance, **kwargs) -> None:
 def post_save_event_invite_create_notification(sender, instance, created, **kwargs) -> None:
     """Create notification after creating invite"""
     if created:
-        create_event_invite_user_notification.delay(target_id=instance.event_id, actor_id=instance.inviter_id,
-                                                    recipient_id=instance.invitee_id)
+        outbox.enqueue(create_event_invite_user_notification, target_id=instance.event_id,
+                       actor_id=instance.inviter_id, recipient_id=instance.invitee_id)
 
 
 @receiver(post_delete, sender=EventInvite)
@@ -67,8 +71,8 @@ def post_delete_drop_pending_invitee_attendance(sender, instance, **kwargs) -> N
     if instance.invitee_attendance.status == Attendance.INVITE_PENDING:
         instance.invitee_attendance.delete()
         # delete invite notification
-        remove_event_invite_user_notification.delay(target_id=instance.event_id, actor_id=instance.inviter_id,
-                                                    recipient_id=instance.invitee_id)
+        outbox.enqueue(remove_event_invite_user_notification, target_id=instance.event_id,
+                       actor_id=instance.inviter_id, recipient_id=instance.invitee_id)
 
 
 @receiver(post_save, sender=Attendance)
@@ -79,40 +83,40 @@ def post_save_attendance(sender: object, instance: Attendance, created: bool, *a
      - attendance status was changed to ATTENDING or MAYBE --- check if exist / create
      - attendance status was changed to DECLINED --- remove reminder
     """
-    # inc any of new statuses in cache
-    incr_in_cache(Event, instance.event_id, instance.status_cache_key)
+    # move counter from old status to the new one
+    old_status = getattr(instance, '_previous_status', None)
+    if old_status != instance.status:
+        if old_status is not None:
+            counters.decr(Event, instance.event_id, Attendance.CACHE_STATUS_KEY_MAP[old_status])
+        counters.incr(Event, instance.event_id, instance.status_cache_key)
+        # friends of user see one more/less attending friend
+        if Attendance.ATTENDING in (old_status, instance.status):
+            friend_counts.attendance_changed(instance.user, [instance.event_id],
+                                             1 if instance.status == Attendance.ATTENDING else -1)
+    instance.set_saved_status()
     # reminders part
-    if created and instance.status not in (instance.DECLINED, instance.INVITE_PENDING):
-        if instance.status == instance.ATTENDING and \
-            instance.event.user_id == instance.user_id and \
-                (instance.created - instance.event.created).seconds <= 5:
-            pass  # Don't create for owner right after event create
-        else:
-            Reminder.objects.create(user_id=instance.user_id, event_id=instance.event_id)
-    elif instance.status == instance.DECLINED:
-        Reminder.objects.filter(user_id=instance.user_id, event_id=instance.event_id).delete()
-    elif instance.status in (instance.ATTENDING, instance.MAYBE):
-        Reminder.objects.get_or_create(user_id=instance.user_id, event_id=instance.event_id)
+    if created and instance.status == instance.ATTENDING and \
+        instance.event.user_id == instance.user_id and \
+            (instance.created - instance.event.created).seconds <= 5:
+        return  # Don't create for owner right after event create
+    sync_reminders([(instance.user_id, instance.event_id, instance.status)])
 
 
 @receiver(pre_save, sender=Attendance)
 def pre_save_attendance(sender: object, instance: Attendance, *args, **kwargs) -> None:
-    """Downcount old attendance status in cache"""
-    try:
-        old_instance = Attendance.objects.get(pk=instance.pk)
-        decr_in_cache(Event, old_instance.event_id, old_instance.status_cache_key)
-    except Attendance.DoesNotExist:
-        # if created old attendance status does not exist
-        pass
+    """Remember old attendance status for counters, status loaded with instance is used instead of a query"""
+    instance._previous_status = instance.get_saved_status()
 
 
 @receiver(post_delete, sender=Attendance)
 def post_delete_attendance_handler(sender, instance: Attendance, **kwargs) -> None:
     """Post delete attendance signal"""
     # downcount attendance in cache
-    decr_in_cache(Event, instance.event_id, instance.status_cache_key)
+    counters.decr(Event, instance.event_id, instance.status_cache_key)
+    if instance.status == Attendance.ATTENDING:
+        friend_counts.attendance_changed(instance.user, [instance.event_id], -1)
     # remove reminder if exist
-    Reminder.objects.filter(user_id=instance.user_id, event_id=instance.event_id).delete()
+    sync_reminders([(instance.user_id, instance.event_id, None)])
 
 
 @receiver(post_save, sender=EventLike)
@@ -120,45 +124,77 @@ def post_save_like(sender: object, instance: EventLike, created: bool, *args, **
     """Post create like signal"""
     if created:
         # upcount event like count in cache
-        incr_in_cache(Event, instance.event_id, instance.CACHE_KEY)
+        counters.incr(Event, instance.event_id, instance.CACHE_KEY)
         # create notification if it is not ownself like
         if instance.user_id != instance.event.user_id:
-            create_event_like_notification.delay(actor_id=instance.user_id, target_id=instance.event_id,
-                                                 recipient_id=instance.event.user_id)
+            outbox.enqueue(create_event_like_notification, actor_id=instance.user_id, target_id=instance.event_id,
+                           recipient_id=instance.event.user_id)
 
 
 @receiver(post_delete, sender=EventLike)
 def post_delete_like(sender, instance: Attendance, **kwargs) -> None:
     # downcount likes in cache
-    decr_in_cache(Event, instance.event_id, instance.CACHE_KEY)
+    counters.decr(Event, instance.event_id, instance.CACHE_KEY)
     # remove like notification
     if instance.user_id != instance.event.user_id:
-        remove_event_like_notification.delay(actor_id=instance.user_id, target_id=instance.event_id,
-                                             recipient_id=instance.event.user_id)
+        outbox.enqueue(remove_event_like_notification, actor_id=instance.user_id, target_id=instance.event_id,
+                       recipient_id=instance.event.user_id)
 
 
 @receiver(post_save, sender=Reminder)
 def post_save_reminder(sender: object, instance: Reminder, *args, **kwargs) -> None:
     """Create or update reminder notification"""
-    transaction.on_commit(
-        lambda: create_reminder_notification.delay(
-            recipient_id=instance.user_id, target_id=instance.event_id, reminder_offset=instance.offset
-        )
-    )
+    outbox.enqueue(create_reminder_notification, recipient_id=instance.user_id, target_id=instance.event_id,
+                   reminder_offset=instance.offset)
 
 
 @receiver(post_delete, sender=Reminder)
 def post_delete_reminder(sender: object, instance: Reminder, *args, **kwargs) -> None:
     """Delete active reminders from notifications"""
-    remove_reminder_notification.delay(recipient_id=instance.user_id, target_id=instance.event_id)
+    outbox.enqueue(remove_reminder_notification, recipient_id=instance.user_id, target_id=instance.event_id)
 
 
 @receiver(post_save, sender=EventComment)
 def post_create_comment_handler(sender, instance, created, *args, **kwargs):
     if created:
-        incr_in_cache(Event, instance.event_id, instance.CACHE_KEY)
+        counters.incr(Event, instance.event_id, instance.CACHE_KEY)
 
 
 @receiver(post_delete, sender=EventComment)
 def post_delete_comment_handler(sender, instance, *args, **kwargs):
-    decr_in_cache(Event, instance.event_id, instance.CACHE_KEY)
+    counters.decr(Event, instance.event_id, instance.CACHE_KEY)
+
+
+@receiver(post_init, sender=UserSocialAuth)
+def remember_social_auth_subscription(sender, instance, **kwargs):
+    """Subscription id the row was loaded with, deferred one is not loaded for this"""
+    instance._loaded_subscription_id = instance.__dict__.get('subscription_id')
+
+
+@receiver(post_save, sender=UserSocialAuth)
+def post_save_social_auth_subscription(sender, instance, **kwargs):
+    """Webhooks of changed subscription must not resolve by cached lookup of the old one"""
+    subscription_id = instance.__dict__.get('subscription_id')
+    if subscription_id != instance._loaded_subscription_id:
+        invalidate_on_commit(instance.provider, instance._loaded_subscription_id, subscription_id)
+        instance._loaded_subscription_id = subscription_id
+
+
+@receiver(post_delete, sender=UserSocialAuth)
+def post_delete_social_auth_subscription(sender, instance, **kwargs):
+    """Webhooks of removed account must not resolve to it anymore"""
+    invalidate_on_commit(instance.provider, instance.subscription_id)
+
+
+@receiver(pre_save, sender=Subscription)
+@receiver(pre_delete, sender=Subscription)
+def pre_change_subscription_friendship(sender, instance, **kwargs):
+    """Friendship of users is made of their subscriptions, remember it before subscription changes"""
+    instance._were_friends = friend_counts.are_friends(instance.user, instance.target_id)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def post_change_subscription_friendship(sender, instance, **kwargs):
+    """Attending friends counts of both users follow their friendship"""
+    friend_counts.friendship_checked(instance.user, instance.target_id, instance._were_friends)
@@ -0,0 +1,101 @@
+"""Garbage collection of storage files of deleted rows
+
+Deleting rows doesn't touch storage. Names of their files are recorded as OrphanedFile in the same transaction,
+so files of rolled back deletes are kept, and collector removes them in background in batches: with one
+DeleteObjects request per 1000 keys on S3, with delete_many() of backends which have it, one by one otherwise.
+A transaction which recorded files starts one collection once it is committed, beat runs collection
+periodically as well for files whose collection was not started. Files which failed to be removed stay
+recorded and are retried by reconcile.
+"""
+
+import logging
+from typing import Iterable, List
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from events import outbox
+from events.models import OrphanedFile
+
+logger = logging.getLogger(__name__)
+
+COLLECT_BATCH_SIZE = 1000
+# limit of keys in one S3 DeleteObjects request
+S3_DELETE_BATCH_SIZE = 1000
+
+
+def _start_collect() -> None:
+    from events.tasks import collect_orphaned_files
+    collect_orphaned_files.delay()
+
+
+def record_orphans(names: Iterable[str]) -> None:
+    """Remember files to delete once current transaction is committed"""
+    orphans = [OrphanedFile(name=name) for name in names if name]
+    if orphans:
+        OrphanedFile.objects.bulk_create(orphans)
+        outbox.on_commit_once(_start_collect)
+
+
+def _delete_from_s3(storage, names: List[str]) -> List[str]:
+    keys = {storage._normalize_name(name): name for name in names}
+    failed = []
+    key_list = list(keys)
+    for i in range(0, len(key_list), S3_DELETE_BATCH_SIZE):
+        response = storage.bucket.delete_objects(Delete={
+            'Objects': [{'Key': key} for key in key_list[i:i + S3_DELETE_BATCH_SIZE]],
+            'Quiet': True,
+        })
+        failed += [keys[error['Key']] for error in response.get('Errors', [])]
+    return failed
+
+
+def delete_files(names: List[str], storage=default_storage) -> List[str]:
+    """Delete files from storage with as few requests as backend allows, return names which were not deleted"""
+    if hasattr(storage, 'bucket') and hasattr(storage, '_normalize_name'):
+        return _delete_from_s3(storage, names)
+    if hasattr(storage, 'delete_many'):
+        return storage.delete_many(names)
+
+    failed = []
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.exception('Failed to delete %s from storage', name)
+            failed.append(name)
+    return failed
+
+
+def collect(batch_size: int = COLLECT_BATCH_SIZE, retry: bool = False) -> int:
+    """
+    Delete recorded files from storage, return number of deleted ones
+    Rows locked by a concurrent collector are skipped, failed ones are left for reconcile.
+    @retry - take files which failed to be deleted before instead of new ones
+    """
+    orphans_qs = OrphanedFile.objects.filter(attempts__gt=0) if retry else OrphanedFile.objects.filter(attempts=0)
+    deleted, last_id = 0, 0
+    while True:
+        with transaction.atomic():
+            orphans = list(
+                orphans_qs.select_for_update(skip_locked=True).filter(id__gt=last_id).order_by('id')[:batch_size]
+            )
+            if not orphans:
+                return deleted
+
+            failed = set(delete_files([orphan.name for orphan in orphans]))
+            OrphanedFile.objects.filter(id__in=[orphan.id for orphan in orphans if orphan.name not in failed]).delete()
+            if failed:
+                OrphanedFile.objects.filter(id__in=[orphan.id for orphan in orphans if orphan.name in failed]) \
+                    .update(attempts=F('attempts') + 1)
+
+        deleted += len(orphans) - len(failed)
+        last_id = orphans[-1].id
+        if len(orphans) < batch_size:
+            return deleted
+
+
+def reconcile(batch_size: int = COLLECT_BATCH_SIZE) -> int:
+    """Retry files which failed to be deleted before, return number of deleted ones"""
+    return collect(batch_size, retry=True)
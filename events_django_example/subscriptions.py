@@ -0,0 +1,53 @@
+"""Lookup of user social auths by provider subscription ids
+
+Webhooks have to answer fast, so subscription id -> social id pairs are kept in shared cache and all ids of one
+notifications payload are resolved with one query. Entries are dropped when subscription of account changes.
+"""
+
+from typing import Dict, Iterable
+
+from django.core.cache import cache
+from django.db import transaction
+
+from users.models import UserSocialAuth
+
+CACHE_KEY = 'calendar_subscription_{}_{}'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def resolve_social_ids(provider: str, subscription_ids: Iterable[str]) -> Dict[str, int]:
+    """Get social ids of known subscriptions, unknown ones are left out"""
+    keys = {CACHE_KEY.format(provider, subscription_id): subscription_id for subscription_id in set(subscription_ids)}
+    if not keys:
+        return {}
+
+    result = {keys[key]: social_id for key, social_id in cache.get_many(list(keys)).items()}
+
+    missing = set(keys.values()) - set(result)
+    if missing:
+        found = dict(
+            UserSocialAuth.objects.filter(
+                provider=provider, subscription_id__in=missing
+            ).values_list('subscription_id', 'pk')
+        )
+        cache.set_many(
+            {CACHE_KEY.format(provider, subscription_id): pk for subscription_id, pk in found.items()},
+            CACHE_TIMEOUT
+        )
+        result.update(found)
+
+    return result
+
+
+def invalidate_subscription(provider: str, subscription_id: str) -> None:
+    """Forget cached social id of subscription"""
+    if subscription_id:
+        cache.delete(CACHE_KEY.format(provider, subscription_id))
+
+
+def invalidate_on_commit(provider: str, *subscription_ids: str) -> None:
+    """Forget cached social ids of subscriptions once current transaction is committed"""
+    def invalidate():
+        for subscription_id in subscription_ids:
+            invalidate_subscription(provider, subscription_id)
+    transaction.on_commit(invalidate)
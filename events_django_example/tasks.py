@@ -1,20 +1,29 @@
 import logging
+from contextlib import closing
 from datetime import datetime, timedelta
 from uuid import uuid4
 
-import pytz
-import requests
-from bs4 import BeautifulSoup
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.shortcuts import reverse
 from rest_framework import status
-from social_django.utils import load_strategy
-from tzlocal.windows_tz import win_tz
 
 from celery_logs.utils import CeleryDatabaseLogger
-from events.models import Attendance, Event
+from events import friend_counts, outbox, storage_gc
+from events.calendar_client import (DEFAULT_PREFETCH_PAGES,
+                                    ProviderResponseError, auth_headers,
+                                    get_session, google_url, graph_url,
+                                    prefetch)
+from events.descriptions import html_to_text
+from events.models import Event
+from events.scheduler import (PROVIDER_BUSY_RETRY, ProviderBusy,
+                              SyncRunning, clear_pending_sync, provider_slot,
+                              refresh_pending_sync, running_sync)
+from events.services import (bulk_attend_from_subscription, delete_events,
+                             sync_events_page)
+from events.subscriptions import invalidate_subscription
+from events.time_normalization import parse_google_times, parse_outlook_times
 from prism.celery import app
 from prism.utils.time_utils import milliseconds
 from users.models import Subscription, UserSocialAuth
@@ -22,20 +31,51 @@ from users.models import Subscription, UserSocialAuth
 UserModel = get_user_model()
 logger = logging.getLogger('django')
 
-MS_TO_PYTZ_TZ_MAP = win_tz.copy()
-MS_TO_PYTZ_TZ_MAP.update({
-    'tzone://Microsoft/Utc': 'UTC',
-})
+GOOGLE_EVENTS_PATH = '/calendar/v3/calendars/primary/events'
+OUTLOOK_DELTA_PATH = '/v1.0/me/calendarView/delta'
+
+SUBSCRIBERS_CHUNK_SIZE = 1000
+# seconds between relays of outbox by beat, backstop of relays started on commit
+DEFAULT_RELAY_INTERVAL = 60
+# seconds between collections of orphaned files by beat, backstop of collections started on commit
+DEFAULT_COLLECT_INTERVAL = 15 * 60
+DEFAULT_RECONCILE_INTERVAL = 60 * 60
+
+
+def update_calendar_data(social_id: int, **values) -> None:
+    """Update calendar data of user social auth under row lock"""
+    with transaction.atomic():
+        social = UserSocialAuth.objects.select_for_update().get(pk=social_id)
+        calendar_data = social.calendar_data
+        calendar_data.update(values)
+        social.calendar_data = calendar_data
+        social.save(update_fields=['calendar_data'])
+
+
+def prefetch_pages_count() -> int:
+    return getattr(settings, 'CALENDAR_SYNC_PREFETCH_PAGES', DEFAULT_PREFETCH_PAGES)
+
+
+def run_exclusive_sync(task, social_id: int, provider: str, sync) -> None:
+    """Run sync of account when no other sync of it runs and provider has a free slot, retry task later otherwise"""
+    try:
+        with running_sync(social_id), provider_slot(provider):
+            # notifications coming from now on need one more sync
+            clear_pending_sync(social_id)
+            sync(task, social_id)
+    except (SyncRunning, ProviderBusy):
+        # this task is the pending sync of account while it waits
+        refresh_pending_sync(social_id)
+        raise task.retry(countdown=PROVIDER_BUSY_RETRY)
 
 
 @app.task(bind=True)
 def subscribe_to_google(self, social_id: int):
     with CeleryDatabaseLogger(self) as celery_logger:
         social = UserSocialAuth.objects.get(pk=social_id)
-        access_token = social.get_access_token(load_strategy())
-        headers = {"Authorization": f"Bearer {access_token}"}
+        headers = auth_headers(social)
 
-        watch_url = 'https://www.googleapis.com/calendar/v3/calendars/primary/events/watch'
+        watch_url = google_url('/calendar/v3/calendars/primary/events/watch')
 
         channel_id = str(uuid4())
 
@@ -49,7 +89,7 @@ def subscribe_to_google(self, social_id: int):
         }
 
         try:
-            response = requests.post(watch_url, headers=headers, json=data)
+            response = get_session().post(watch_url, headers=headers, json=data)
         except Exception as e:
             celery_logger.log({'error': str(e), 'social_id': social_id})
             raise
@@ -75,13 +115,12 @@ def subscribe_to_google(self, social_id: int):
 
 def unsubscribe_from_google(social_id: int):
     social = UserSocialAuth.objects.get(pk=social_id)
-    access_token = social.get_access_token(load_strategy())
-    headers = {"Authorization": f"Bearer {access_token}"}
+    headers = auth_headers(social)
 
     if not social.subscription_id and social.provider != 'google-oauth2':
         return
 
-    stop_url = 'https://www.googleapis.com/calendar/v3/channels/stop'
+    stop_url = google_url('/calendar/v3/channels/stop')
 
     channel_id = social.subscription_id
     resource_id = social.calendar_data.get('resource_id')
@@ -92,142 +131,132 @@ def unsubscribe_from_google(social_id: int):
     }
 
     try:
-        response = requests.post(stop_url, headers=headers, json=data)
+        response = get_session().post(stop_url, headers=headers, json=data)
     except Exception:
         print("EXCEPTION DURING CANCELLING SUBSCRIPTION")
     else:
         if response.status_code == status.HTTP_200_OK:
             print("SUBSCRIPTION CANCELED")
-            Event.objects.filter(user=social.user, provider=social.provider).delete()
+            invalidate_subscription(social.provider, social.subscription_id)
+            delete_events(Event.objects.filter(user=social.user, provider=social.provider))
         else:
             print("CANCELLING SUBSCRIPTION FAILED")
             print(response.status_code, response.content)
 
 
-def sync_google_event(google_event: dict, user: UserModel, user_timezone: str):
-    if google_event.get('status') == 'cancelled':
-        try:
-            Event.objects.get(user=user, provider='google-oauth2', external_id=google_event.get('id')).delete()
-        except Event.DoesNotExist:
-            pass
-
-        return
+def parse_google_events(google_events: list, user_timezone: str) -> list:
+    """Get event field values from page of google event resources"""
+    times = parse_google_times(google_events, user_timezone)
+    return [
+        {
+            'title': google_event.get('summary', ''),
+            'description': html_to_text(google_event.get('description', '')),
+            'start': start,
+            'end': end,
+            'start_timezone': start_timezone,
+            'end_timezone': end_timezone,
+        }
+        for google_event, (start, start_timezone, end, end_timezone) in zip(google_events, times)
+    ]
 
-    start = google_event['start'].get('dateTime')
-    start_timezone = google_event['start'].get('timeZone', user_timezone)
 
-    if not start:
-        start = google_event['start'].get('date')
-        start = datetime.fromisoformat(start)
+def parse_google_event(google_event: dict, user_timezone: str) -> dict:
+    """Get event field values from google event resource"""
+    return parse_google_events([google_event], user_timezone)[0]
 
-        if not start.tzinfo:
-            start = pytz.timezone(start_timezone).localize(start)
-        start = start.astimezone(pytz.utc)
 
-    end = google_event['end'].get('dateTime')
-    end_timezone = google_event['end'].get('timeZone', user_timezone)
+def sync_google_events_page(google_events: list, user: UserModel, user_timezone: str):
+    """Sync whole page of google events with constant number of queries"""
+    # later items of the page win, like they did when items were synced one by one
+    latest = {google_event.get('id'): google_event for google_event in google_events}
 
-    if not end:
-        end = google_event['end'].get('date')
-        end = datetime.fromisoformat(end)
+    removed_ids = {external_id for external_id, google_event in latest.items()
+                   if google_event.get('status') == 'cancelled'}
+    active = [google_event for external_id, google_event in latest.items() if external_id not in removed_ids]
+    upserts = dict(zip(
+        (google_event.get('id') for google_event in active),
+        parse_google_events(active, user_timezone)
+    ))
 
-        if not end.tzinfo:
-            end = pytz.timezone(end_timezone).localize(end)
-        end = end.astimezone(pytz.utc)
+    sync_events_page(user, 'google-oauth2', upserts, removed_ids)
 
-    description = BeautifulSoup(google_event.get('description', ''), 'lxml').get_text().strip()
 
-    defaults = {
-        'title': google_event.get('summary', ''),
-        'description': description,
-        'start': start,
-        'end': end,
-        'start_timezone': start_timezone,
-        'end_timezone': end_timezone,
-    }
+def sync_google_event(google_event: dict, user: UserModel, user_timezone: str):
+    sync_google_events_page([google_event], user=user, user_timezone=user_timezone)
 
-    Event.objects.update_or_create(
-        external_id=google_event.get('id'),
-        provider='google-oauth2',
-        user=user,
-        defaults=defaults
-    )
 
+def iter_google_pages(headers: dict, sync_token: str = None):
+    """Get pages of google events, full sync is started again if provider asks for it"""
+    url = google_url(GOOGLE_EVENTS_PATH)
+    query_params = {
+        'timeZone': 'utc'
+    }
 
-@app.task(bind=True)
-def sync_google_events(self, social_id: int):
-    with CeleryDatabaseLogger(self) as celery_logger:
-        social = UserSocialAuth.objects.get(pk=social_id)
-        access_token = social.get_access_token(load_strategy())
-        headers = {"Authorization": f"Bearer {access_token}"}
-        url = 'https://www.googleapis.com/calendar/v3/calendars/primary/events'
+    if not sync_token:
+        query_params['timeMin'], query_params['timeMax'] = UserSocialAuth.get_sync_bounds()
 
-        sync_token = social.calendar_data.get('sync_token')
-        query_params = {
-            'timeZone': 'utc'
-        }
+    if sync_token:
+        query_params['syncToken'] = sync_token
 
-        if not sync_token:
+    while True:
+        response = get_session().get(url, headers=headers, params=query_params)
+        if response.status_code == status.HTTP_200_OK:
+            result = response.json()
+            yield result
+
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return
+            query_params['pageToken'] = page_token
+        elif response.status_code == status.HTTP_410_GONE and \
+                response.json()['error']['errors'][0]['reason'] == 'fullSyncRequired':
+            query_params.pop('syncToken')
+            query_params.pop('pageToken', None)
             query_params['timeMin'], query_params['timeMax'] = UserSocialAuth.get_sync_bounds()
+        else:
+            raise ProviderResponseError(response.status_code, response.text)
 
-        if sync_token:
-            query_params['syncToken'] = sync_token
-
-        page_token = None
 
-        while True:
-            if page_token:
-                query_params['pageToken'] = page_token
+def _sync_google_events(task, social_id: int):
+    with CeleryDatabaseLogger(task) as celery_logger:
+        social = UserSocialAuth.objects.get(pk=social_id)
+        headers = auth_headers(social)
+        sync_token = social.calendar_data.get('sync_token')
 
-            try:
-                response = requests.get(url, headers=headers, params=query_params)
-            except Exception as e:
-                celery_logger.log({'social_id': social_id, 'error': str(e)})
-                raise
-            else:
-                if response.status_code == status.HTTP_200_OK:
-                    result = response.json()
+        # next pages are fetched while current one is written, sync token is saved only after all of them
+        # prefetch is closed on failure as well, so its producer thread doesn't wait on a full queue
+        try:
+            with closing(prefetch(iter_google_pages(headers, sync_token), prefetch_pages_count())) as pages:
+                for result in pages:
+                    sync_google_events_page(result['items'], user=social.user, user_timezone=result['timeZone'])
+                    sync_token = result.get('nextSyncToken')
+        except ProviderResponseError as e:
+            celery_logger.log({
+                'social_id': social_id,
+                'status_code': e.status_code,
+                'response': e.text
+            })
+            return
+        except Exception as e:
+            celery_logger.log({'social_id': social_id, 'error': str(e)})
+            raise
 
-                    events = result['items']
-                    for google_event in events:
-                        sync_google_event(google_event, user=social.user, user_timezone=result['timeZone'])
+        update_calendar_data(social_id, sync_token=sync_token)
+        celery_logger.log({'social_id': social_id})
 
-                    page_token = result.get('nextPageToken')
-                    sync_token = result.get('nextSyncToken')
 
-                    if not page_token:
-                        break
-                elif response.status_code == status.HTTP_410_GONE and \
-                        response.json()['error']['errors'][0]['reason'] == 'fullSyncRequired':
-                    query_params.pop('syncToken')
-                    query_params.pop('pageToken', None)
-                    query_params['timeMin'], query_params['timeMax'] = UserSocialAuth.get_sync_bounds()
-                    continue
-                else:
-                    celery_logger.log({
-                        'social_id': social_id,
-                        'status_code': response.status_code,
-                        'response': response.text
-                    })
-                    return
-
-        with transaction.atomic():
-            social = UserSocialAuth.objects.select_for_update().get(pk=social_id)
-            calendar_data = social.calendar_data
-            calendar_data['sync_token'] = sync_token
-            social.calendar_data = calendar_data
-            social.save(update_fields=['calendar_data'])
-            celery_logger.log({'social_id': social_id})
+@app.task(bind=True, max_retries=None)
+def sync_google_events(self, social_id: int):
+    run_exclusive_sync(self, social_id, 'google-oauth2', _sync_google_events)
 
 
 @app.task(bind=True)
 def subscribe_to_outlook(self, social_id: int):
     with CeleryDatabaseLogger(self) as celery_logger:
         social = UserSocialAuth.objects.get(pk=social_id)
-        access_token = social.get_access_token(load_strategy())
-        headers = {"Authorization": f"Bearer {access_token}"}
+        headers = auth_headers(social)
 
-        watch_url = 'https://graph.microsoft.com/v1.0/subscriptions'
+        watch_url = graph_url('/v1.0/subscriptions')
 
         dt_utc = datetime.utcnow()
         expiration_date_time = dt_utc + timedelta(milliseconds=UserSocialAuth.SUBSCRIPTION_DURATION)
@@ -240,7 +269,7 @@ def subscribe_to_outlook(self, social_id: int):
         }
 
         try:
-            response = requests.post(watch_url, headers=headers, json=data)
+            response = get_session().post(watch_url, headers=headers, json=data)
         except Exception as e:
             celery_logger.log({'social_id': social_id, 'error': str(e)})
             raise
@@ -263,142 +292,195 @@ def subscribe_to_outlook(self, social_id: int):
                 })
 
 
-def sync_outlook_event(outlook_event: dict, user: UserModel):
-    if outlook_event.get('seriesMasterId'):
-        # Skip recurring event, we are saving only the main recurring event
-        return
+def parse_outlook_events(outlook_events: list) -> list:
+    """Get event field values from page of outlook event resources"""
+    times = parse_outlook_times(outlook_events)
+    events = []
+    for outlook_event, (start, start_timezone, end, end_timezone) in zip(outlook_events, times):
+        if outlook_event['body']['contentType'] == 'html':
+            description = html_to_text(outlook_event['body']['content'], body_only=True)
+        else:
+            description = outlook_event['body']['content']
 
-    if outlook_event.get('@removed'):
-        try:
-            Event.objects.get(user=user, provider='microsoft-graph', external_id=outlook_event.get('id')).delete()
-        except Event.DoesNotExist:
-            pass
-        return
+        events.append({
+            'title': outlook_event.get('subject', ''),
+            'description': description,
+            'start': start,
+            'end': end,
+            'start_timezone': start_timezone,
+            'end_timezone': end_timezone,
+        })
+    return events
 
-    start = outlook_event['start'].get('dateTime')
-    start_timezone = MS_TO_PYTZ_TZ_MAP.get(outlook_event['originalStartTimeZone'], outlook_event['originalStartTimeZone'])
-    start = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S.%f0')
-    start = start.astimezone(pytz.utc)
 
-    end = outlook_event['end'].get('dateTime')
-    end_timezone = MS_TO_PYTZ_TZ_MAP.get(outlook_event['originalEndTimeZone'], outlook_event['originalEndTimeZone'])
-    end = datetime.strptime(end, '%Y-%m-%dT%H:%M:%S.%f0')
-    end = end.astimezone(pytz.utc)
+def parse_outlook_event(outlook_event: dict) -> dict:
+    """Get event field values from outlook event resource"""
+    return parse_outlook_events([outlook_event])[0]
 
-    if outlook_event['body']['contentType'] == 'html':
-        bs = BeautifulSoup(outlook_event['body']['content'], 'lxml')
-        body = bs.find('body')
-        description = (body if body else bs).get_text().strip()
-    else:
-        description = outlook_event['body']['content']
-
-    defaults = {
-        'title': outlook_event.get('subject', ''),
-        'description': description,
-        'start': start,
-        'end': end,
-        'start_timezone': start_timezone,
-        'end_timezone': end_timezone,
+
+def sync_outlook_events_page(outlook_events: list, user: UserModel):
+    """Sync whole delta page of outlook events with constant number of queries"""
+    latest = {
+        outlook_event.get('id'): outlook_event
+        for outlook_event in outlook_events
+        # Skip recurring event, we are saving only the main recurring event
+        if not outlook_event.get('seriesMasterId')
     }
 
-    Event.objects.update_or_create(
-        external_id=outlook_event.get('id'),
-        provider='microsoft-graph',
-        user=user,
-        defaults=defaults
-    )
+    removed_ids = {external_id for external_id, outlook_event in latest.items() if outlook_event.get('@removed')}
+    active = [outlook_event for external_id, outlook_event in latest.items() if external_id not in removed_ids]
+    upserts = dict(zip(
+        (outlook_event.get('id') for outlook_event in active),
+        parse_outlook_events(active)
+    ))
 
+    sync_events_page(user, 'microsoft-graph', upserts, removed_ids)
 
-@app.task(bind=True)
-def sync_outlook_events(self, social_id: int):
-    with CeleryDatabaseLogger(self) as celery_logger:
-        social = UserSocialAuth.objects.get(pk=social_id)
-        access_token = social.get_access_token(load_strategy())
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-        }
 
-        delta_link = social.calendar_data.get('delta_link')
+def sync_outlook_event(outlook_event: dict, user: UserModel):
+    sync_outlook_events_page([outlook_event], user=user)
 
-        query_params = dict()
 
-        url = 'https://graph.microsoft.com/v1.0/me/calendarView/delta'
+def iter_outlook_pages(headers: dict, delta_link: str = None):
+    """Get delta pages of outlook events until empty page"""
+    query_params = dict()
 
-        if not delta_link:
-            query_params['startDateTime'], query_params['endDateTime'] = UserSocialAuth.get_sync_bounds()
-        else:
-            url = delta_link
-
-        while True:
-            try:
-                response = requests.get(url, headers=headers, params=query_params)
-            except Exception as e:
-                celery_logger.log({'social_id': social_id, 'error': str(e)})
-                raise
-            else:
-                if response.status_code == status.HTTP_200_OK:
-                    result = response.json()
+    url = graph_url(OUTLOOK_DELTA_PATH)
+
+    if not delta_link:
+        query_params['startDateTime'], query_params['endDateTime'] = UserSocialAuth.get_sync_bounds()
+    else:
+        url = delta_link
+
+    while True:
+        response = get_session().get(url, headers=headers, params=query_params)
+        if response.status_code != status.HTTP_200_OK:
+            raise ProviderResponseError(response.status_code, response.text)
 
-                    events = result['value']
-                    for outlook_event in events:
-                        sync_outlook_event(outlook_event, user=social.user)
+        result = response.json()
+        yield result
+
+        if not result['value']:
+            return
+        url = result.get('@odata.deltaLink') or result.get('@odata.nextLink')
+        query_params = dict()
+
+
+def _sync_outlook_events(task, social_id: int):
+    with CeleryDatabaseLogger(task) as celery_logger:
+        social = UserSocialAuth.objects.get(pk=social_id)
+        headers = auth_headers(social)
+        delta_link = social.calendar_data.get('delta_link')
 
+        try:
+            with closing(prefetch(iter_outlook_pages(headers, delta_link), prefetch_pages_count())) as pages:
+                for result in pages:
+                    sync_outlook_events_page(result['value'], user=social.user)
                     delta_link = result.get('@odata.deltaLink')
-                    next_link = result.get('@odata.nextLink')
-
-                    url = delta_link or next_link
-                    query_params = dict()
-
-                    if not events:
-                        break
-                else:
-                    celery_logger.log({
-                        'social_id': social_id,
-                        'status_code': response.status_code,
-                        'response': response.text
-                    })
-                    return
-
-        with transaction.atomic():
-            social = UserSocialAuth.objects.select_for_update().get(pk=social_id)
-            calendar_data = social.calendar_data
-            calendar_data['delta_link'] = delta_link
-            social.calendar_data = calendar_data
-            social.save(update_fields=['calendar_data'])
-            celery_logger.log({'social_id': social_id})
+        except ProviderResponseError as e:
+            celery_logger.log({
+                'social_id': social_id,
+                'status_code': e.status_code,
+                'response': e.text
+            })
+            return
+        except Exception as e:
+            celery_logger.log({'social_id': social_id, 'error': str(e)})
+            raise
+
+        update_calendar_data(social_id, delta_link=delta_link)
+        celery_logger.log({'social_id': social_id})
+
+
+@app.task(bind=True, max_retries=None)
+def sync_outlook_events(self, social_id: int):
+    run_exclusive_sync(self, social_id, 'microsoft-graph', _sync_outlook_events)
 
 
 def unsubscribe_from_outlook(social_id: int):
     social = UserSocialAuth.objects.get(pk=social_id)
-    access_token = social.get_access_token(load_strategy())
-    headers = {"Authorization": f"Bearer {access_token}"}
+    headers = auth_headers(social)
 
     if not social.subscription_id and social.provider != 'microsoft-graph':
         return
 
-    stop_url = f'https://graph.microsoft.com/v1.0/subscriptions/{social.subscription_id}'
+    stop_url = graph_url(f'/v1.0/subscriptions/{social.subscription_id}')
 
     try:
-        response = requests.delete(stop_url, headers=headers)
+        response = get_session().delete(stop_url, headers=headers)
     except Exception as ex:
         raise ex
     else:
         if response.status_code == status.HTTP_204_NO_CONTENT:
             print("SUBSCRIPTION CANCELED")
-            Event.objects.filter(user=social.user, provider=social.provider).delete()
+            invalidate_subscription(social.provider, social.subscription_id)
+            delete_events(Event.objects.filter(user=social.user, provider=social.provider))
         else:
             print(response.content)
             print("CANCELLING SUBSCRIPTION FAILED")
 
 
+@app.task(bind=True)
+def sync_calendars_concurrently(self, social_ids: list):
+    """Sync calendars of many accounts from one worker process, see events.calendar_async"""
+    from events.calendar_async import sync_accounts
+
+    with CeleryDatabaseLogger(self) as celery_logger:
+        errors = sync_accounts(social_ids)
+        celery_logger.log({'social_ids': social_ids, 'errors': errors})
+
+
 @app.task(bind=True)
 def create_attendance_for_subscribers(self, event_id, user_id):
+    """Split subscribers of event creator into chunks processed by separate tasks"""
     with CeleryDatabaseLogger(self):
         subscriber_ids = list(Subscription.objects.filter(target_id=user_id).values_list('user_id', flat=True))
-        # we want a bunch of signals to trigger on attendance creation, so no bulk create
-        for sub_id in subscriber_ids:
-            Attendance.objects.create(
-                user_id=sub_id,
-                event_id=event_id,
-                status=Attendance.ATTENDING,
-                is_from_subscription=True)
+        for i in range(0, len(subscriber_ids), SUBSCRIBERS_CHUNK_SIZE):
+            create_attendance_for_subscribers_chunk.delay(event_id, subscriber_ids[i:i + SUBSCRIBERS_CHUNK_SIZE])
+
+
+@app.task(bind=True)
+def create_attendance_for_subscribers_chunk(self, event_id, subscriber_ids):
+    with CeleryDatabaseLogger(self):
+        created_ids = bulk_attend_from_subscription(event_id, subscriber_ids)
+        friend_counts.users_attended(UserModel.objects.filter(id__in=created_ids), event_id)
+
+
+@app.task(bind=True)
+def relay_notifications(self):
+    """Send notification tasks written to outbox, started after commits which wrote them and by beat"""
+    with CeleryDatabaseLogger(self):
+        outbox.relay()
+
+
+app.add_periodic_task(getattr(settings, 'NOTIFICATIONS_RELAY_INTERVAL', DEFAULT_RELAY_INTERVAL),
+                      relay_notifications.s(), name='events.relay_notifications')
+
+
+@app.task(bind=True)
+def collect_orphaned_files(self):
+    """Delete files of deleted rows from storage, started after commits which recorded them and by beat"""
+    with CeleryDatabaseLogger(self):
+        storage_gc.collect()
+
+
+@app.task(bind=True)
+def reconcile_orphaned_files(self):
+    """Retry files which failed to be deleted, run by beat"""
+    with CeleryDatabaseLogger(self):
+        storage_gc.reconcile()
+
+
+app.add_periodic_task(getattr(settings, 'STORAGE_GC_COLLECT_INTERVAL', DEFAULT_COLLECT_INTERVAL),
+                      collect_orphaned_files.s(), name='events.collect_orphaned_files')
+app.add_periodic_task(getattr(settings, 'STORAGE_GC_RECONCILE_INTERVAL', DEFAULT_RECONCILE_INTERVAL),
+                      reconcile_orphaned_files.s(), name='events.reconcile_orphaned_files')
+
+
+@app.task(bind=True)
+def backfill_friend_attendance_counts(self, user_ids: list = None):
+    """Recount attending friends of users (all of them by default), run once after deploy"""
+    with CeleryDatabaseLogger(self):
+        viewers = UserModel.objects.all() if user_ids is None else UserModel.objects.filter(id__in=user_ids)
+        for viewer in viewers.iterator():
+            friend_counts.rebuild_viewer(viewer)
@@ -1,19 +1,68 @@
+import asyncio
 import datetime as dt
+import itertools
 import tempfile
-from unittest import skip
+import threading
+from concurrent.futures import Executor, Future
+from unittest import mock, skip
 
 import pytz
+from bs4 import BeautifulSoup
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from PIL import Image
+from rest_framework import serializers
 from rest_framework.status import (HTTP_200_OK, HTTP_201_CREATED,
                                    HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST,
                                    HTTP_404_NOT_FOUND)
 from rest_framework.test import APITestCase
 
+from notifications.tasks import (create_event_like_notification,
+                                 create_reminder_notification,
+                                 remove_reminder_notification)
 from system.timezones import TIMEZONES
-
-from .models import Event, EventImage
+from users.api.serializers import UserPreviewSerializer
+from users.models import Subscription, UserSocialAuth
+
+from . import counters, friend_counts, outbox, previews, storage_gc
+from .api.fast_serializers import compile_serializer
+from .api.fields import clear_url_cache, storage_url
+from .api.prefetch import plan_queryset, related_lookups
+from .api.serializers import (
+    EventDetailSerializer, EventDiscoveryPreviewSerializer,
+    EventFeedSerializer, EventImageSerializer,
+    EventNotificationWithAttendanceStatusSerializer,
+    EventNotificationWithLikesSerializer, EventPreviewSerializer,
+    EventPreviewWithUserSerializer)
+from .api.viewsets import EventViewSet
+from .calendar_async import AccountsSyncEngine
+from .calendar_client import reset_session
+from .descriptions import html_to_text
+from .fake_provider import EXPIRED_SYNC_TOKEN, FakeCalendarProvider
+from .fake_storage import BulkDeleteFileSystemStorage
+from .middleware import CounterBatchMiddleware
+from .models import (Attendance, Event, EventComment, EventImage,
+                     EventInvite, EventLike, NotificationOutbox, OrphanedFile,
+                     Reminder)
+from .reminders import sync_reminders
+from .scheduler import (PENDING_KEY, RUNNING_KEY, SLOTS_KEY, ProviderBusy,
+                        clear_pending_sync, provider_slot, running_sync)
+from .services import (bulk_attend_from_subscription, bulk_create_events,
+                       bulk_invite, bulk_uninvite, delete_events)
+from .subscriptions import CACHE_KEY as SUBSCRIPTION_CACHE_KEY
+from .subscriptions import invalidate_subscription, resolve_social_ids
+from .tasks import (run_exclusive_sync, sync_google_events,
+                    sync_google_events_page, sync_outlook_events_page)
+from .time_normalization import parse_google_times, parse_outlook_times
+from .viewer_context import ViewerContext
 
 
 class TestBasicEvents(APITestCase):
@@ -383,3 +432,1041 @@ class TestImagesEvents(APITestCase):
         img_obj = EventImage.objects.get(id=img_dict['id'])
         max_length_by_side = img_obj.SIZES['large']['resolution'][0]
         self.assertTrue(img_obj.image.width <= max_length_by_side and img_obj.image.height <= max_length_by_side)
+
+
+class UsersAndEventsMixin:
+    """Users, public events and user.friends of users app, shared by tests which need them"""
+
+    def create_users(self, count, offset=0):
+        return [
+            get_user_model().objects.create_user(email=f'user{i}@example.com', first_name='User',
+                                                 password='12345678ABC')
+            for i in range(offset, offset + count)
+        ]
+
+    def create_events(self, user, count, **fields):
+        fields = {'title': 'Title', 'is_private': False, 'start_timezone': TIMEZONES[0],
+                  'start': dt.datetime.now(pytz.utc), 'end_timezone': TIMEZONES[0], 'end': dt.datetime.now(pytz.utc),
+                  **fields}
+        return [Event.objects.create(user=user, **fields) for _ in range(count)]
+
+    def patch_friends(self, friendships):
+        """user.friends gives users whose ids friendships maps user's id to"""
+        User = get_user_model()
+        friends = property(lambda user: User.objects.filter(id__in=friendships.get(user.id, ())))
+        patcher = mock.patch.object(User, 'friends', friends, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestGoogleEventsPageSync(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.user, = self.create_users(1)
+
+    @staticmethod
+    def _google_event(external_id, summary='Title', status='confirmed'):
+        return {
+            'id': external_id,
+            'status': status,
+            'summary': summary,
+            'description': '<b>Desc</b>',
+            'start': {'dateTime': '2020-07-10T12:00:00Z'},
+            'end': {'dateTime': '2020-07-10T13:00:00Z'},
+        }
+
+    def test_sync_page_creates_updates_and_deletes(self):
+        sync_google_events_page([self._google_event('1'), self._google_event('2')], self.user, 'UTC')
+        self.assertEqual(Event.objects.filter(user=self.user, provider='google-oauth2').count(), 2)
+        self.assertTrue(Attendance.objects.filter(event__external_id='1', user=self.user).exists())
+
+        sync_google_events_page([
+            self._google_event('1', summary='Changed'),
+            self._google_event('2', status='cancelled'),
+            self._google_event('3'),
+        ], self.user, 'UTC')
+
+        events = Event.objects.filter(user=self.user, provider='google-oauth2')
+        self.assertEqual(sorted(events.values_list('external_id', flat=True)), ['1', '3'])
+        self.assertEqual(events.get(external_id='1').title, 'Changed')
+        self.assertEqual(events.get(external_id='1').description, 'Desc')
+
+    def test_sync_page_skips_unchanged_events(self):
+        sync_google_events_page([self._google_event('1'), self._google_event('2')], self.user, 'UTC')
+        updated = dict(Event.objects.filter(user=self.user).values_list('external_id', 'updated'))
+
+        sync_google_events_page([self._google_event('1'), self._google_event('2', summary='Changed')],
+                                self.user, 'UTC')
+
+        events = Event.objects.filter(user=self.user)
+        self.assertEqual(events.get(external_id='1').updated, updated['1'])
+        self.assertNotEqual(events.get(external_id='2').updated, updated['2'])
+        self.assertEqual(events.get(external_id='2').title, 'Changed')
+
+    def test_sync_page_later_items_win(self):
+        sync_google_events_page([
+            self._google_event('1'),
+            self._google_event('1', status='cancelled'),
+        ], self.user, 'UTC')
+        self.assertFalse(Event.objects.filter(user=self.user, external_id='1').exists())
+
+
+class TestOutlookEventsPageSync(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.user, = self.create_users(1)
+
+    @staticmethod
+    def _outlook_event(external_id, subject='Title', **extra):
+        return {
+            'id': external_id,
+            'subject': subject,
+            'body': {'contentType': 'text', 'content': 'Desc'},
+            'start': {'dateTime': '2020-07-10T12:00:00.0000000', 'timeZone': 'UTC'},
+            'end': {'dateTime': '2020-07-10T13:00:00.0000000', 'timeZone': 'UTC'},
+            'originalStartTimeZone': 'tzone://Microsoft/Utc',
+            'originalEndTimeZone': 'tzone://Microsoft/Utc',
+            **extra
+        }
+
+    def test_sync_delta_page(self):
+        sync_outlook_events_page([self._outlook_event('1'), self._outlook_event('2')], self.user)
+
+        sync_outlook_events_page([
+            {'id': '1', '@removed': {'reason': 'deleted'}},
+            self._outlook_event('2', subject='Changed'),
+            self._outlook_event('3', seriesMasterId='2'),
+        ], self.user)
+
+        events = Event.objects.filter(user=self.user, provider='microsoft-graph')
+        self.assertEqual(list(events.values_list('external_id', flat=True)), ['2'])
+        self.assertEqual(events.get().title, 'Changed')
+        self.assertEqual(events.get().start_timezone, 'UTC')
+
+
+class TestCalendarSyncWithFakeProvider(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.user, = self.create_users(1)
+        self.social = UserSocialAuth.objects.create(user=self.user, provider='google-oauth2', uid='uid',
+                                                    extra_data={'access_token': 'token'})
+        reset_session()
+
+    def test_sync_google_events_reuses_connection(self):
+        google_events = [TestGoogleEventsPageSync._google_event(str(i)) for i in range(5)]
+        with FakeCalendarProvider(google_events=google_events, page_size=2) as provider:
+            with override_settings(GOOGLE_CALENDAR_API_URL=provider.url):
+                sync_google_events.apply(args=(self.social.id,))
+
+        self.assertEqual(Event.objects.filter(user=self.user, provider='google-oauth2').count(), 5)
+        self.assertEqual(len(provider.requests), 3)
+        self.assertEqual(provider.connections, 1)
+        self.social.refresh_from_db()
+        self.assertTrue(self.social.calendar_data.get('sync_token'))
+
+    def test_sync_google_events_restarts_full_sync_with_prefetch(self):
+        self.social.calendar_data = {'sync_token': EXPIRED_SYNC_TOKEN}
+        self.social.save(update_fields=['calendar_data'])
+        google_events = [TestGoogleEventsPageSync._google_event(str(i)) for i in range(5)]
+
+        with FakeCalendarProvider(google_events=google_events, page_size=2) as provider:
+            with override_settings(GOOGLE_CALENDAR_API_URL=provider.url, CALENDAR_SYNC_PREFETCH_PAGES=2):
+                sync_google_events.apply(args=(self.social.id,))
+
+        self.assertEqual(Event.objects.filter(user=self.user, provider='google-oauth2').count(), 5)
+        self.social.refresh_from_db()
+        self.assertNotEqual(self.social.calendar_data['sync_token'], EXPIRED_SYNC_TOKEN)
+
+    def test_failing_page_write_stops_prefetch(self):
+        producers = []
+
+        def endless_pages(headers, sync_token):
+            producers.append(threading.current_thread())
+            for i in itertools.count():
+                yield {'items': [], 'timeZone': 'UTC', 'nextPageToken': str(i)}
+
+        with mock.patch('events.tasks.iter_google_pages', endless_pages), \
+                mock.patch('events.tasks.sync_google_events_page', side_effect=RuntimeError('write failed')), \
+                override_settings(CALENDAR_SYNC_PREFETCH_PAGES=2):
+            result = sync_google_events.apply(args=(self.social.id,))
+
+        self.assertIsInstance(result.result, RuntimeError)
+        # failed task keeps its traceback, producer must not be left waiting for the queue to drain
+        self.assertFalse(producers[0].is_alive())
+
+
+class TestDescriptionsToText(SimpleTestCase):
+    CORPUS = [
+        'Plain text description',
+        '  Weekly sync  ',
+        'Tom & Jerry',
+        'Tom &amp; Jerry <b>bold</b><br>next line',
+        '<p>Join Zoom Meeting<br><a href="https://zoom.us/j/1">https://zoom.us/j/1</a></p><p>Meeting ID: 1</p>',
+        '<ul><li>one</li><li>two</li></ul>',
+        '<!-- comment -->text &#39;quoted&#39;',
+        '<html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8">'
+        '<style>p {margin:0}</style></head>'
+        '<body><div>Hello&nbsp;world</div><script>x = 1</script></body></html>',
+        'Line one\r\nLine two\rLine three',
+        'a<b',
+        '1 < 2',
+        '<title>Title</title><p>Text</p>',
+        '<p>one</p>  \n  <p>two</p><pre>  \n  </pre>',
+        '<ruby>kanji<rp>(</rp><rt>kana</rt><rp>)</rp></ruby><template>hidden</template>',
+        '\ufeffBOM <b>text</b>',
+        'Null\x00char',
+    ]
+
+    def test_same_text_as_beautiful_soup(self):
+        for content in self.CORPUS:
+            soup = BeautifulSoup(content, 'lxml')
+            body = soup.find('body')
+            self.assertEqual(html_to_text(content), soup.get_text().strip())
+            self.assertEqual(html_to_text(content, body_only=True), (body if body else soup).get_text().strip())
+
+    def test_plain_text_is_not_parsed(self):
+        with mock.patch('events.descriptions._extract_text') as extract_text:
+            self.assertEqual(html_to_text(' Plain text '), 'Plain text')
+        extract_text.assert_not_called()
+
+
+class TestTimeNormalization(SimpleTestCase):
+    def test_google_times_to_utc(self):
+        times = parse_google_times([{
+            'start': {'dateTime': '2020-07-10T12:00:00+02:00'},
+            'end': {'date': '2020-07-11', 'timeZone': 'Europe/Kiev'},
+        }], 'UTC')
+        self.assertEqual(times, [(dt.datetime(2020, 7, 10, 10, tzinfo=pytz.utc), 'UTC',
+                                  dt.datetime(2020, 7, 10, 21, tzinfo=pytz.utc), 'Europe/Kiev')])
+
+    def test_outlook_times_to_utc(self):
+        times = parse_outlook_times([{
+            'start': {'dateTime': '2020-07-10T12:00:00.0000000', 'timeZone': 'UTC'},
+            'end': {'dateTime': '2020-07-10T13:00:00.0000000', 'timeZone': 'Pacific Standard Time'},
+            'originalStartTimeZone': 'Pacific Standard Time',
+            'originalEndTimeZone': 'tzone://Microsoft/Utc',
+        }])
+        self.assertEqual(times, [(dt.datetime(2020, 7, 10, 12, tzinfo=pytz.utc), 'America/Los_Angeles',
+                                  dt.datetime(2020, 7, 10, 20, tzinfo=pytz.utc), 'UTC')])
+
+    def test_unknown_timezone_fails_before_parsing(self):
+        with self.assertRaises(pytz.UnknownTimeZoneError):
+            parse_google_times([
+                {'start': {'date': '2020-07-10'}, 'end': {'date': '2020-07-11'}},
+            ], 'Bogus/McBogusFace')
+
+
+class InlineExecutor(Executor):
+    """Runs database work of async engine in the test thread, so it sees rows of test transaction"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TestWebhookBurst(UsersAndEventsMixin, APITestCase):
+    BURST_SIZE = 200
+
+    def setUp(self):
+        self.user, = self.create_users(1)
+        self.google_social = UserSocialAuth.objects.create(user=self.user, provider='google-oauth2', uid='g',
+                                                           subscription_id='channel')
+        self.outlook_social = UserSocialAuth.objects.create(user=self.user, provider='microsoft-graph', uid='o',
+                                                            subscription_id='subscription')
+        cache.delete_many([
+            PENDING_KEY.format(self.google_social.id), PENDING_KEY.format(self.outlook_social.id),
+            SUBSCRIPTION_CACHE_KEY.format('google-oauth2', 'channel'),
+            SUBSCRIPTION_CACHE_KEY.format('microsoft-graph', 'subscription'),
+        ])
+
+    @mock.patch('events.tasks.sync_google_events.apply_async')
+    def test_google_burst_is_coalesced(self, apply_async):
+        for _ in range(self.BURST_SIZE):
+            response = self.client.post(reverse('google_webhook'), HTTP_X_GOOG_CHANNEL_ID='channel')
+            self.assertEqual(response.status_code, HTTP_200_OK)
+
+        apply_async.assert_called_once()
+        self.assertEqual(apply_async.call_args[1]['args'], (self.google_social.id,))
+
+        # sync started, next notification needs one more sync
+        clear_pending_sync(self.google_social.id)
+        self.client.post(reverse('google_webhook'), HTTP_X_GOOG_CHANNEL_ID='channel')
+        self.assertEqual(apply_async.call_count, 2)
+
+    @mock.patch('events.tasks.sync_outlook_events.apply_async')
+    def test_outlook_burst_is_coalesced(self, apply_async):
+        notifications = {'value': [{'subscriptionId': 'subscription'}] * 10}
+        for _ in range(self.BURST_SIZE // 10):
+            self.client.post(reverse('outlook_webhook'), notifications, format='json')
+
+        apply_async.assert_called_once()
+
+    def test_subscriptions_resolved_with_one_query(self):
+        subscription_ids = ['subscription', 'unknown'] * 10
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_social_ids('microsoft-graph', subscription_ids),
+                             {'subscription': self.outlook_social.id})
+        with self.assertNumQueries(1):
+            # unknown ids are not cached
+            resolve_social_ids('microsoft-graph', subscription_ids)
+        with self.assertNumQueries(0):
+            resolve_social_ids('microsoft-graph', ['subscription'])
+
+        invalidate_subscription('microsoft-graph', 'subscription')
+        with self.assertNumQueries(1):
+            resolve_social_ids('microsoft-graph', ['subscription'])
+
+    def test_changed_subscription_is_dropped_after_commit(self):
+        key = SUBSCRIPTION_CACHE_KEY.format('google-oauth2', 'channel')
+        resolve_social_ids('google-oauth2', ['channel'])
+        social = UserSocialAuth.objects.get(pk=self.google_social.pk)
+
+        with mock.patch('events.subscriptions.transaction.on_commit') as on_commit:
+            social.calendar_data = {'sync_token': 'token'}
+            social.save(update_fields=['calendar_data'])
+            on_commit.assert_not_called()
+
+            social.subscription_id = 'new-channel'
+            social.save()
+            # webhooks coming before commit still resolve the old subscription
+            self.assertEqual(cache.get(key), social.pk)
+            on_commit.call_args[0][0]()
+
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(resolve_social_ids('google-oauth2', ['channel', 'new-channel']),
+                         {'new-channel': social.pk})
+
+    @override_settings(CALENDAR_SYNC_PROVIDER_CONCURRENCY={'google-oauth2': 1})
+    def test_provider_concurrency_is_capped(self):
+        cache.delete(SLOTS_KEY.format('google-oauth2'))
+        with provider_slot('google-oauth2'):
+            with self.assertRaises(ProviderBusy):
+                with provider_slot('google-oauth2'):
+                    pass
+        with provider_slot('google-oauth2'):
+            pass
+
+    @override_settings(CALENDAR_SYNC_PROVIDER_CONCURRENCY={'google-oauth2': 1})
+    @mock.patch('events.calendar_async._in_db_thread', lambda func, *args, **kwargs: func(*args, **kwargs))
+    def test_async_engine_takes_provider_slot(self):
+        social_id = self.google_social.id
+        cache.delete_many([RUNNING_KEY.format(social_id), SLOTS_KEY.format('google-oauth2')])
+
+        async def sync():
+            engine = AccountsSyncEngine(http=None, db_executor=InlineExecutor(), concurrency=1)
+            await engine.sync(social_id)
+
+        with provider_slot('google-oauth2'):
+            with self.assertRaises(ProviderBusy):
+                asyncio.run(sync())
+        self.assertIsNone(cache.get(RUNNING_KEY.format(social_id)))
+
+        with mock.patch('events.calendar_async.auth_headers', return_value={}), \
+                mock.patch.object(AccountsSyncEngine, 'sync_google') as sync_google:
+            asyncio.run(sync())
+        sync_google.assert_called_once()
+        # slot is given back after sync
+        self.assertEqual(cache.get(SLOTS_KEY.format('google-oauth2')), 0)
+
+    def test_running_account_is_not_synced_twice(self):
+        social_id = self.google_social.id
+        cache.delete_many([RUNNING_KEY.format(social_id), SLOTS_KEY.format('google-oauth2')])
+        task, sync = mock.Mock(), mock.Mock()
+        task.retry.return_value = RuntimeError('retry')
+
+        with running_sync(social_id):
+            with self.assertRaisesMessage(RuntimeError, 'retry'):
+                run_exclusive_sync(task, social_id, 'google-oauth2', sync)
+        sync.assert_not_called()
+        # waiting task stays the pending sync, webhooks don't enqueue more
+        self.assertTrue(cache.get(PENDING_KEY.format(social_id)))
+
+        run_exclusive_sync(task, social_id, 'google-oauth2', sync)
+        sync.assert_called_once_with(task, social_id)
+        self.assertIsNone(cache.get(PENDING_KEY.format(social_id)))
+        self.assertIsNone(cache.get(RUNNING_KEY.format(social_id)))
+
+
+class TestSubscribersFanOut(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.creator, = self.create_users(1)
+        self.event, = self.create_events(self.creator, 1, is_private=True)
+
+    def _create_subscribers(self, count, offset=0):
+        # creator is the first user
+        return [user.id for user in self.create_users(count, offset + 1)]
+
+    def test_queries_do_not_depend_on_subscribers_count(self):
+        for offset, count in ((0, 5), (5, 50)):
+            user_ids = self._create_subscribers(count, offset)
+            # reminder notifications are written to outbox in the same transaction
+            with self.assertNumQueries(7):
+                created = bulk_attend_from_subscription(self.event.id, user_ids)
+            self.assertEqual(len(created), count)
+
+        attendances = Attendance.objects.filter(event=self.event, is_from_subscription=True)
+        self.assertEqual(attendances.count(), 55)
+        self.assertEqual(Reminder.objects.filter(event=self.event).count(), 55)
+
+    def test_existing_attendances_are_kept(self):
+        user_ids = self._create_subscribers(3)
+        Attendance.objects.create(event=self.event, user_id=user_ids[0], status=Attendance.DECLINED)
+
+        self.assertEqual(bulk_attend_from_subscription(self.event.id, user_ids), user_ids[1:])
+        self.assertEqual(Attendance.objects.get(event=self.event, user_id=user_ids[0]).status, Attendance.DECLINED)
+        self.assertFalse(Reminder.objects.filter(event=self.event, user_id=user_ids[0]).exists())
+
+    def test_subscribers_of_page_owner_are_checked_once(self):
+        Subscription.objects.create(user_id=self._create_subscribers(1)[0], target=self.creator)
+        subscriptions_table = Subscription._meta.db_table
+
+        subscription_queries = []
+        for count in (1, 3):
+            events = [
+                Event(title='Public', user=self.creator, is_private=False,
+                      start_timezone=TIMEZONES[0], start=dt.datetime.now(pytz.utc),
+                      end_timezone=TIMEZONES[0], end=dt.datetime.now(pytz.utc))
+                for _ in range(count)
+            ]
+            with mock.patch('events.services.schedule_subscribers_attendance') as schedule, \
+                    CaptureQueriesContext(connection) as queries:
+                bulk_create_events(events)
+            self.assertEqual(schedule.call_count, count)
+            subscription_queries.append(
+                sum(subscriptions_table in query['sql'] for query in queries.captured_queries)
+            )
+        self.assertEqual(subscription_queries[0], subscription_queries[1])
+
+    def test_event_creation_does_not_wait_for_subscribers(self):
+        for user_id in self._create_subscribers(20):
+            Subscription.objects.create(user_id=user_id, target=self.creator)
+
+        with mock.patch('events.services.transaction.on_commit') as on_commit, \
+                mock.patch('events.tasks.create_attendance_for_subscribers.delay') as delay:
+            event = Event.objects.create(title='Public', user=self.creator, is_private=False,
+                                         start_timezone=TIMEZONES[0], start=dt.datetime.now(pytz.utc),
+                                         end_timezone=TIMEZONES[0], end=dt.datetime.now(pytz.utc))
+            self.assertEqual(Attendance.objects.filter(is_from_subscription=True).count(), 0)
+            delay.assert_not_called()
+
+            # commit
+            for args, kwargs in on_commit.call_args_list:
+                args[0]()
+
+        # subscribers are processed by background task enqueued after commit
+        delay.assert_called_once_with(event.id, self.creator.id)
+        self.assertEqual(Attendance.objects.filter(is_from_subscription=True).count(), 0)
+
+
+class TestEventCounters(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.user, = self.create_users(1)
+        self.event, = self.create_events(self.user, 1, is_private=True)
+        cache.delete_many([counters.counter_key(self.event.id, EventLike.CACHE_KEY),
+                           counters.pending_key(self.event.id, EventLike.CACHE_KEY)])
+        counters.clear_local_cache()
+
+    @mock.patch('events.counters.transaction.on_commit', lambda func: func())
+    def test_changes_are_written_once_per_batch(self):
+        with mock.patch('events.counters.flush') as flush:
+            with counters.batch():
+                for _ in range(3):
+                    counters.incr(Event, self.event.id, EventLike.CACHE_KEY)
+                counters.decr(Event, self.event.id, EventLike.CACHE_KEY)
+                flush.assert_not_called()
+
+        flush.assert_called_once_with({(Event, self.event.id, EventLike.CACHE_KEY): 2})
+
+    @mock.patch('events.counters.transaction.on_commit', lambda func: func())
+    def test_changes_of_request_are_written_once(self):
+        def view(request):
+            for _ in range(3):
+                counters.incr(Event, self.event.id, EventLike.CACHE_KEY)
+            flush.assert_not_called()
+            return HttpResponse()
+
+        with mock.patch('events.counters.flush') as flush:
+            response = CounterBatchMiddleware(view)(RequestFactory().get('/'))
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        flush.assert_called_once_with({(Event, self.event.id, EventLike.CACHE_KEY): 3})
+
+    @mock.patch('events.counters.transaction.on_commit', lambda func: func())
+    def test_missing_counter_is_counted_from_rows(self):
+        key = counters.counter_key(self.event.id, EventLike.CACHE_KEY)
+        cache.delete(key)
+        # change of counter which is not cached is not written
+        EventLike.objects.create(event=self.event, user=self.user)
+        self.assertIsNone(cache.get(key))
+
+        counters.clear_local_cache()
+        with self.assertNumQueries(1):
+            self.assertEqual(counters.get_count(self.event, EventLike.CACHE_KEY), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.get_count(self.event, EventLike.CACHE_KEY), 1)
+
+    def test_counter_filled_by_other_process_is_not_overwritten(self):
+        key = counters.counter_key(self.event.id, EventLike.CACHE_KEY)
+        cache.delete(key)
+        counters.clear_local_cache()
+
+        def count_while_other_process_fills(events, missing):
+            # other process counted first and already flushed a like to it
+            cache.set(key, 5)
+            return {counter: 4 for counter in missing}
+
+        with mock.patch('events.counters._count_in_db', side_effect=count_while_other_process_fills):
+            self.assertEqual(counters.get_count(self.event, EventLike.CACHE_KEY), 5)
+        self.assertEqual(cache.get(key), 5)
+
+    def test_change_written_while_counting_is_kept(self):
+        key = counters.counter_key(self.event.id, EventLike.CACHE_KEY)
+
+        def count_while_like_is_written(events, missing):
+            # like committed after rows were counted is written by its request before the count is cached
+            counters.flush({(Event, self.event.id, EventLike.CACHE_KEY): 1})
+            return {counter: 0 for counter in missing}
+
+        with mock.patch('events.counters._count_in_db', side_effect=count_while_like_is_written):
+            self.assertEqual(counters.get_count(self.event, EventLike.CACHE_KEY), 1)
+        self.assertEqual(cache.get(key), 1)
+        self.assertIsNone(cache.get(counters.pending_key(self.event.id, EventLike.CACHE_KEY)))
+
+    @mock.patch('events.counters.transaction.on_commit', lambda func: func())
+    def test_buffered_change_is_not_counted_twice(self):
+        with counters.batch():
+            EventLike.objects.create(event=self.event, user=self.user)
+            # cold read counts the like, its buffered change is written to the cached value after the batch
+            counters.get_count(self.event, EventLike.CACHE_KEY)
+
+        counters.clear_local_cache()
+        self.assertEqual(counters.get_count(self.event, EventLike.CACHE_KEY), 1)
+
+    def test_counters_of_list_are_fetched_at_once(self):
+        events = [self.event] + [
+            Event.objects.create(title='Title', user=self.user, is_private=True,
+                                 start_timezone=TIMEZONES[0], start=dt.datetime.now(pytz.utc),
+                                 end_timezone=TIMEZONES[0], end=dt.datetime.now(pytz.utc))
+            for _ in range(19)
+        ]
+        EventLike.objects.bulk_create([EventLike(event=event, user=self.user) for event in events[:10]])
+        cache.delete_many([counters.counter_key(event.id, EventLike.CACHE_KEY) for event in events])
+
+        with mock.patch('events.counters.cache.get_many', wraps=cache.get_many) as get_many:
+            # one grouped count for counters missing in cache
+            with self.assertNumQueries(1):
+                data = EventNotificationWithLikesSerializer(events, many=True).data
+            get_many.assert_called_once()
+
+            counters.clear_local_cache()
+            with self.assertNumQueries(0):
+                EventNotificationWithLikesSerializer(events, many=True).data
+            self.assertEqual(get_many.call_count, 2)
+
+        self.assertEqual([item['counters'][EventLike.CACHE_KEY] for item in data], [1] * 10 + [0] * 10)
+
+
+class TestAttendanceStatusTracking(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.user, = self.create_users(1)
+        self.event, = self.create_events(self.user, 1, is_private=True)
+
+    @mock.patch('events.counters.transaction.on_commit', lambda func: func())
+    def test_status_change_is_counted_without_select(self):
+        attendance = Attendance.objects.get(event=self.event, user=self.user)
+        attendance.status = Attendance.MAYBE
+
+        with mock.patch('events.counters.flush') as flush, counters.batch():
+            with CaptureQueriesContext(connection) as queries:
+                attendance.save()
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and '"events_attendance"' in query['sql']
+        ])
+        flush.assert_called_once_with({
+            (Event, self.event.id, 'attending'): -1,
+            (Event, self.event.id, 'maybe'): 1,
+        })
+
+        # saved status is the new one now, saving again changes nothing
+        with mock.patch('events.counters.flush') as flush, counters.batch():
+            attendance.save()
+        flush.assert_not_called()
+
+
+class TestNotificationOutbox(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.owner, self.user = self.create_users(2)
+        self.event, = self.create_events(self.owner, 1)
+        NotificationOutbox.objects.all().delete()
+
+    @mock.patch('events.outbox.app.send_task')
+    def test_signals_write_outbox_instead_of_broker(self, send_task):
+        EventLike.objects.create(event=self.event, user=self.user)
+        send_task.assert_not_called()
+
+        message = NotificationOutbox.objects.get()
+        self.assertEqual(message.task, create_event_like_notification.name)
+        self.assertEqual(message.kwargs, {'actor_id': self.user.id, 'target_id': self.event.id,
+                                          'recipient_id': self.owner.id})
+
+        self.assertEqual(outbox.relay(), 1)
+        send_task.assert_called_once()
+        self.assertEqual(send_task.call_args[0], (message.task,))
+        self.assertEqual(send_task.call_args[1]['kwargs'], message.kwargs)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+
+    @mock.patch('events.tasks.relay_notifications.delay')
+    def test_relay_starts_once_per_transaction(self, delay):
+        def relay_callbacks():
+            return [func for _, func in connection.run_on_commit if func is outbox._start_relay]
+
+        with transaction.atomic():
+            EventLike.objects.create(event=self.event, user=self.user)
+            EventLike.objects.filter(event=self.event, user=self.user).get().delete()
+        self.assertEqual(NotificationOutbox.objects.count(), 2)
+        self.assertEqual(len(relay_callbacks()), 1)
+
+        # commit
+        relay_callbacks()[0]()
+        delay.assert_called_once_with()
+
+
+class TestSyncReminders(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.owner, *users = self.create_users(5)
+        self.users = [user.id for user in users]
+        self.event, = self.create_events(self.owner, 1, is_private=True)
+        Reminder.objects.create(event=self.event, user_id=self.users[0])
+        Reminder.objects.create(event=self.event, user_id=self.users[1])
+        NotificationOutbox.objects.all().delete()
+
+    def test_transitions_are_applied_in_bulk(self):
+        transitions = [
+            (self.users[0], self.event.id, Attendance.MAYBE),  # kept
+            (self.users[1], self.event.id, Attendance.DECLINED),  # deleted
+            (self.users[2], self.event.id, Attendance.ATTENDING),  # created
+            (self.users[3], self.event.id, Attendance.INVITE_PENDING),  # nothing
+        ]
+        with self.assertNumQueries(5):
+            sync_reminders(transitions)
+
+        self.assertEqual(set(Reminder.objects.filter(event=self.event).values_list('user_id', flat=True)),
+                         {self.users[0], self.users[2]})
+        self.assertEqual(
+            [(message.task, message.kwargs['recipient_id']) for message in NotificationOutbox.objects.order_by('id')],
+            [(create_reminder_notification.name, self.users[2]), (remove_reminder_notification.name, self.users[1])]
+        )
+
+
+class TestBulkInvite(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.owner, = self.create_users(1)
+        self.client.force_authenticate(user=self.owner)
+        self.event, = self.create_events(self.owner, 1, is_private=True,
+                                         end=dt.datetime.now(pytz.utc) + dt.timedelta(days=1))
+
+    def _create_invitees(self, count, offset=0):
+        # owner is the first user
+        return [user.id for user in self.create_users(count, offset + 1)]
+
+    def test_queries_do_not_depend_on_invitees_count(self):
+        for offset, count in ((0, 5), (5, 50)):
+            user_ids = self._create_invitees(count, offset)
+            with self.assertNumQueries(5):
+                invites = bulk_invite(self.event, self.owner, user_ids)
+            self.assertEqual(len(invites), count)
+
+        self.assertEqual(Attendance.objects.filter(event=self.event, status=Attendance.INVITE_PENDING).count(), 55)
+        self.assertEqual(EventInvite.objects.filter(event=self.event, invitee_attendance__user=F('invitee')).count(),
+                         55)
+
+    def test_invite_endpoint(self):
+        user_ids = self._create_invitees(3)
+        NotificationOutbox.objects.all().delete()
+
+        response = self.client.post(reverse('event-invite', args=[self.event.id]),
+                                    {'ids': [*user_ids, self.owner.id]}, format='json')
+
+        self.assertEqual(response.status_code, HTTP_204_NO_CONTENT)
+        self.assertEqual(set(EventInvite.objects.filter(event=self.event).values_list('invitee_id', flat=True)),
+                         set(user_ids))
+        self.assertEqual(NotificationOutbox.objects.count(), 3)
+
+    def test_queries_of_uninvite_do_not_depend_on_invitees_count(self):
+        for offset, count in ((0, 5), (5, 50)):
+            user_ids = self._create_invitees(count, offset)
+            bulk_invite(self.event, self.owner, user_ids)
+            with self.assertNumQueries(7):
+                self.assertEqual(bulk_uninvite(self.event, user_ids), count)
+
+        self.assertFalse(Attendance.objects.filter(event=self.event, status=Attendance.INVITE_PENDING).exists())
+        self.assertFalse(EventInvite.objects.filter(event=self.event).exists())
+
+    def test_uninvite_endpoint_drops_own_invites_only(self):
+        guest = get_user_model().objects.create_user(email='guest@example.com', first_name='Guest',
+                                                     password='12345678ABC')
+        owner_invitee, guest_invitee = self._create_invitees(2)
+        bulk_invite(self.event, self.owner, [guest.id, owner_invitee])
+        bulk_invite(self.event, guest, [guest_invitee])
+        NotificationOutbox.objects.all().delete()
+
+        self.client.force_authenticate(user=guest)
+        response = self.client.post(reverse('event-uninvite', args=[self.event.id]),
+                                    {'ids': [owner_invitee, guest_invitee]}, format='json')
+
+        self.assertEqual(response.status_code, HTTP_204_NO_CONTENT)
+        self.assertEqual(list(EventInvite.objects.filter(event=self.event).values_list('invitee_id', flat=True)
+                              .order_by('invitee_id')), sorted([guest.id, owner_invitee]))
+        self.assertEqual(NotificationOutbox.objects.get().kwargs,
+                         {'target_id': self.event.id, 'actor_id': guest.id, 'recipient_id': guest_invitee})
+
+
+class TestDeleteEvents(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.owner, = self.create_users(1)
+        self.client.force_authenticate(user=self.owner)
+        self.event, = self.create_events(self.owner, 1, end=dt.datetime.now(pytz.utc) + dt.timedelta(days=1))
+
+    def _add_guests(self, count, offset=0):
+        # owner is the first user
+        user_ids = [user.id for user in self.create_users(count, offset + 1)]
+        bulk_attend_from_subscription(self.event.id, user_ids[:count // 2])
+        bulk_invite(self.event, self.owner, user_ids[count // 2:])
+        EventLike.objects.bulk_create([EventLike(event=self.event, user_id=user_id) for user_id in user_ids])
+
+    def test_queries_do_not_depend_on_guests_count(self):
+        self._add_guests(4)
+        with CaptureQueriesContext(connection) as few_guests:
+            delete_events(Event.objects.filter(pk=self.event.pk))
+
+        self.event, = self.create_events(self.owner, 1)
+        self._add_guests(40, offset=4)
+        with CaptureQueriesContext(connection) as many_guests:
+            delete_events(Event.objects.filter(pk=self.event.pk))
+
+        self.assertEqual(len(few_guests), len(many_guests))
+        self.assertFalse(Attendance.objects.exists())
+        self.assertFalse(EventInvite.objects.exists())
+
+    def test_destroy_endpoint_hands_notifications_to_outbox(self):
+        self._add_guests(4)
+        NotificationOutbox.objects.all().delete()
+
+        response = self.client.delete(reverse('event-detail', args=[self.event.id]))
+
+        self.assertEqual(response.status_code, HTTP_204_NO_CONTENT)
+        self.assertFalse(Event.objects.filter(pk=self.event.pk).exists())
+        # likes, pending invites and reminders of attending guests
+        self.assertEqual(NotificationOutbox.objects.count(), 4 + 2 + 2)
+
+
+@override_settings(DEFAULT_FILE_STORAGE='events.fake_storage.BulkDeleteFileSystemStorage',
+                   MEDIA_ROOT=tempfile.gettempdir())
+class TestStorageGarbageCollection(APITestCase):
+    def setUp(self):
+        BulkDeleteFileSystemStorage.bulk_deletes = []
+        BulkDeleteFileSystemStorage.failing_names = set()
+        self.names = [default_storage.save(f'e/gc/{i}.jpg', ContentFile(b'image')) for i in range(5)]
+
+    def tearDown(self):
+        for name in self.names:
+            default_storage.delete(name)
+
+    def test_orphans_are_deleted_in_one_batch(self):
+        storage_gc.record_orphans(self.names)
+        self.assertTrue(all(default_storage.exists(name) for name in self.names))
+
+        self.assertEqual(storage_gc.collect(), 5)
+
+        self.assertEqual(BulkDeleteFileSystemStorage.bulk_deletes, [self.names])
+        self.assertFalse(any(default_storage.exists(name) for name in self.names))
+        self.assertFalse(OrphanedFile.objects.exists())
+
+    def test_failed_deletes_are_reconciled(self):
+        BulkDeleteFileSystemStorage.failing_names = {self.names[0]}
+        storage_gc.record_orphans(self.names)
+
+        self.assertEqual(storage_gc.collect(), 4)
+        self.assertEqual(OrphanedFile.objects.get().attempts, 1)
+        # failed files are not retried by regular collection
+        self.assertEqual(storage_gc.collect(), 0)
+
+        BulkDeleteFileSystemStorage.failing_names = set()
+        self.assertEqual(storage_gc.reconcile(), 1)
+        self.assertFalse(default_storage.exists(self.names[0]))
+        self.assertFalse(OrphanedFile.objects.exists())
+
+    @mock.patch('events.tasks.collect_orphaned_files.delay')
+    def test_collection_starts_once_per_transaction(self, delay):
+        def collect_callbacks():
+            return [func for _, func in connection.run_on_commit if func is storage_gc._start_collect]
+
+        with transaction.atomic():
+            storage_gc.record_orphans(self.names[:2])
+            storage_gc.record_orphans(self.names[2:])
+        self.assertEqual(OrphanedFile.objects.count(), 5)
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(len(collect_callbacks()), 1)
+
+        # commit
+        collect_callbacks()[0]()
+        delay.assert_called_once_with()
+
+
+class TestFriendAttendanceCounts(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.viewer, self.first, self.second = self.create_users(3)
+        self.patch_friends({
+            self.viewer.id: {self.first.id, self.second.id},
+            self.first.id: {self.viewer.id},
+            self.second.id: {self.viewer.id},
+        })
+        self.event, = self.create_events(self.viewer, 1)
+
+    def _count(self):
+        return friend_counts.get_counts(self.viewer, [self.event.id])[self.event.id]
+
+    def test_counts_follow_attendance_changes(self):
+        first_attendance = Attendance.objects.create(event=self.event, user=self.first, status=Attendance.ATTENDING)
+        self.assertEqual(self._count(), 1)
+
+        second_attendance = Attendance.objects.create(event=self.event, user=self.second, status=Attendance.MAYBE)
+        self.assertEqual(self._count(), 1)
+        second_attendance.status = Attendance.ATTENDING
+        second_attendance.save()
+        self.assertEqual(self._count(), 2)
+
+        first_attendance.delete()
+        self.assertEqual(self._count(), 1)
+
+        friend_counts.rebuild_viewer(self.viewer)
+        self.assertEqual(self._count(), 1)
+
+    def test_counts_follow_friendship_changes(self):
+        Attendance.objects.create(event=self.event, user=self.first, status=Attendance.ATTENDING)
+
+        friend_counts.friendship_removed(self.viewer.id, self.first.id)
+        self.assertEqual(self._count(), 0)
+        friend_counts.friendship_created(self.viewer.id, self.first.id)
+        self.assertEqual(self._count(), 1)
+
+    def test_friendship_made_of_subscriptions_is_followed(self):
+        User = get_user_model()
+        mutual_subscriptions = property(lambda user: User.objects.filter(
+            id__in=Subscription.objects.filter(user=user).values('target_id')
+        ).filter(id__in=Subscription.objects.filter(target=user).values('user_id')))
+
+        with mock.patch.object(User, 'friends', mutual_subscriptions):
+            Attendance.objects.create(event=self.event, user=self.first, status=Attendance.ATTENDING)
+            Subscription.objects.create(user=self.viewer, target=self.first)
+            self.assertEqual(self._count(), 0)
+            subscription = Subscription.objects.create(user=self.first, target=self.viewer)
+            self.assertEqual(self._count(), 1)
+            subscription.delete()
+            self.assertEqual(self._count(), 0)
+
+    def test_subscribers_attending_at_once_are_counted_in_bulk(self):
+        # friends read, missing rows insert, one update for viewer who is friend of both
+        with self.assertNumQueries(3):
+            friend_counts.users_attended([self.first, self.second], self.event.id)
+        self.assertEqual(self._count(), 2)
+        self.assertEqual(friend_counts.get_counts(self.first, [self.event.id]), {self.event.id: 0})
+
+
+class TestViewerContext(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.owner, self.viewer = self.create_users(2)
+        self.events = self.create_events(self.owner, 10, end=dt.datetime.now(pytz.utc) + dt.timedelta(days=1))
+        Attendance.objects.create(event=self.events[0], user=self.viewer, status=Attendance.MAYBE)
+        EventLike.objects.create(event=self.events[1], user=self.viewer)
+        bulk_invite(self.events[2], self.owner, [self.viewer.id])
+
+    def test_relations_are_loaded_once_for_all_events(self):
+        context = ViewerContext(self.viewer, [event.id for event in self.events])
+        with self.assertNumQueries(4):
+            for event in self.events:
+                context.attendance_status(event.id)
+                context.liked(event.id)
+                context.reminder(event.id)
+                context.inviter(event.id)
+
+        self.assertEqual(context.attendance_status(self.events[0].id), Attendance.MAYBE)
+        self.assertEqual(context.attendance_status(self.events[2].id), Attendance.INVITE_PENDING)
+        self.assertIsNone(context.attendance_status(self.events[3].id))
+        self.assertTrue(context.liked(self.events[1].id))
+        self.assertFalse(context.liked(self.events[0].id))
+        self.assertIsNotNone(context.reminder(self.events[0].id))
+        self.assertEqual(context.inviter(self.events[2].id), self.owner)
+
+    def test_list_serializer_uses_one_query(self):
+        request = mock.Mock(user=self.viewer)
+        with self.assertNumQueries(1):
+            data = EventNotificationWithAttendanceStatusSerializer(self.events, many=True,
+                                                                   context={'request': request}).data
+        self.assertEqual([item['viewer_attendance_status'] for item in data[:3]],
+                         [Attendance.MAYBE, None, Attendance.INVITE_PENDING])
+
+
+class TestAttendancePreview(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.viewer, *self.users = self.create_users(6)
+        self.patch_friends({self.viewer.id: {self.users[3].id, self.users[4].id}})
+        self.events = self.create_events(self.users[0], 3)
+        for event in self.events:
+            for user, status in zip(self.users[1:], (Attendance.ATTENDING, Attendance.DECLINED, Attendance.MAYBE,
+                                                     Attendance.ATTENDING)):
+                Attendance.objects.create(event=event, user=user, status=status)
+
+    def test_friends_go_first(self):
+        with self.assertNumQueries(1):
+            preview = previews.attendance_preview(self.viewer, self.events[0].id, 4)
+        self.assertEqual([(attendance.user, attendance.status) for attendance in preview], [
+            (self.users[4], Attendance.ATTENDING),
+            (self.users[3], Attendance.MAYBE),
+            (self.users[0], Attendance.ATTENDING),
+            (self.users[1], Attendance.ATTENDING),
+        ])
+
+    def test_previews_of_many_events_match_single_ones(self):
+        event_ids = [event.id for event in self.events]
+        with self.assertNumQueries(1):
+            many = previews.attendance_previews(self.viewer, event_ids, 4)
+        for event_id in event_ids:
+            self.assertEqual(many[event_id], previews.attendance_preview(self.viewer, event_id, 4))
+
+
+class TestCommentsPreview(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.owner, self.guest = self.create_users(2)
+        self.events = self.create_events(self.owner, 3)
+        Attendance.objects.create(event=self.events[0], user=self.guest, status=Attendance.MAYBE)
+        for event in self.events[:2]:
+            for i in range(3):
+                EventComment.objects.create(event=event, user=(self.owner, self.guest)[i % 2], body=f'{i}')
+
+    def test_latest_comments_of_page_are_loaded_at_once(self):
+        event_ids = [event.id for event in self.events]
+        with self.assertNumQueries(2):
+            comments, statuses = previews.comments_previews(event_ids, 2)
+
+        for event in self.events:
+            self.assertEqual(comments[event.id], list(event.comments.order_by('-id')[:2]))
+        self.assertEqual(statuses[self.events[0].id], {self.owner.id: Attendance.ATTENDING,
+                                                       self.guest.id: Attendance.MAYBE})
+        self.assertEqual(statuses[self.events[1].id], {self.owner.id: Attendance.ATTENDING})
+        self.assertEqual(statuses[self.events[2].id], {})
+
+
+class OwnerPreviewSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = get_user_model()
+        fields = ('id', 'first_name')
+
+
+class EventWithOwnerPreviewSerializer(EventPreviewWithUserSerializer):
+    """EventPreviewWithUserSerializer with nested user of plain model fields, which always compiles"""
+    user = OwnerPreviewSerializer(read_only=True)
+
+
+class TestCompiledPreviewSerializers(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.user, = self.create_users(1)
+        self.client.force_authenticate(user=self.user)
+        self.events = [
+            self.create_events(self.user, 1, title=f'Title {i}', start_timezone=TIMEZONES[i],
+                               end=dt.datetime.now(pytz.utc) + dt.timedelta(days=1),
+                               main_image='e/main.jpg' if i % 2 else None,
+                               main_image_cropped='e/main_cropped.jpg' if i % 2 else '')[0]
+            for i in range(4)
+        ]
+        self.context = {'request': RequestFactory().get('/')}
+
+    def test_output_matches_drf(self):
+        queryset = Event.objects.order_by('id')
+        for serializer_class in (EventPreviewSerializer, EventDiscoveryPreviewSerializer,
+                                 EventWithOwnerPreviewSerializer):
+            compiled = compile_serializer(serializer_class)
+            self.assertIsNotNone(compiled)
+            with self.assertNumQueries(1):
+                data = compiled.serialize(compiled.values(queryset), self.context)
+            self.assertEqual(data, serializer_class(queryset, many=True, context=self.context).data)
+
+    def test_method_fields_are_not_compiled(self):
+        self.assertIsNone(compile_serializer(EventNotificationWithLikesSerializer))
+
+    def test_nested_serializer_compiles_when_its_fields_do(self):
+        # the only field EventPreviewWithUserSerializer adds to EventPreviewSerializer is nested user
+        self.assertEqual(compile_serializer(EventPreviewWithUserSerializer) is None,
+                         compile_serializer(UserPreviewSerializer) is None)
+
+    def test_list_falls_back_to_drf(self):
+        with mock.patch('events.api.fast_serializers.compile_serializer', return_value=None) as compile_mock:
+            response = self.client.get(reverse('event-list'), {'limit': 10})
+
+        compile_mock.assert_called_once_with(EventPreviewSerializer)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        expected = EventPreviewSerializer(Event.objects.order_by('id'), many=True,
+                                          context={'request': response.wsgi_request}).data
+        self.assertEqual(sorted(response.data['results'], key=lambda event: event['id']), expected)
+
+    def test_list_is_built_from_values(self):
+        response = self.client.get(reverse('event-list'), {'limit': 10})
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['count'], len(self.events))
+        expected = EventPreviewSerializer(Event.objects.order_by('id'), many=True,
+                                          context={'request': response.wsgi_request}).data
+        self.assertEqual(sorted(response.data['results'], key=lambda event: event['id']), expected)
+
+
+class TestPlannedQuerysets(UsersAndEventsMixin, APITestCase):
+    def setUp(self):
+        self.user, = self.create_users(1)
+        self.event, = self.create_events(self.user, 1)
+        EventImage.objects.bulk_create([
+            EventImage(event=self.event, image=f'e/{self.event.id}/{i}.jpg', position=i) for i in range(3)
+        ])
+        clear_url_cache()
+        self.addCleanup(clear_url_cache)
+
+    def test_lookups_follow_serializer_fields(self):
+        for serializer_class in (EventDetailSerializer, EventFeedSerializer):
+            select, prefetch = related_lookups(serializer_class)
+            self.assertIn('user', select)
+            self.assertIn('images', prefetch)
+        self.assertEqual(related_lookups(EventPreviewSerializer), ((), ()))
+
+    def test_only_serializing_actions_are_planned(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        for action, planned in (('retrieve', True), ('update', False), ('destroy', False), ('invite', False)):
+            queryset = EventViewSet(action=action, request=request, format_kwarg=None).get_queryset()
+            self.assertEqual('images' in queryset._prefetch_related_lookups, planned)
+
+    def test_images_are_prefetched(self):
+        event = plan_queryset(Event.objects.filter(pk=self.event.pk), EventDetailSerializer).get()
+        with self.assertNumQueries(0):
+            data = EventImageSerializer(event.images.all(), many=True).data
+        self.assertEqual(sorted(image['position'] for image in data), [0, 1, 2])
+
+    def test_storage_urls_are_cached(self):
+        storage = mock.Mock()
+        storage.url.side_effect = lambda name: f'/media/{name}'
+
+        self.assertEqual(storage_url(storage, 'a.jpg'), '/media/a.jpg')
+        self.assertEqual(storage_url(storage, 'a.jpg'), '/media/a.jpg')
+        self.assertEqual(storage.url.call_count, 1)
+
+        clear_url_cache()
+        storage_url(storage, 'a.jpg')
+        self.assertEqual(storage.url.call_count, 2)
+
+    def test_image_representation_is_not_changed(self):
+        image = self.event.images.order_by('position').first()
+        request = RequestFactory().get('/')
+        data = EventImageSerializer(image, context={'request': request}).data
+        self.assertEqual(data, {'id': image.id, 'image': request.build_absolute_uri(image.image.url),
+                                'position': 0})
@@ -0,0 +1,94 @@
+"""Timezones and datetimes of provider events
+
+Resolved timezones are cached by google/windows zone name and whole pages of start/end values are converted to
+UTC in one call. Unknown zones are reported before anything of the page is parsed.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+import pytz
+from tzlocal.windows_tz import win_tz
+
+MS_TO_PYTZ_TZ_MAP = win_tz.copy()
+MS_TO_PYTZ_TZ_MAP.update({
+    'tzone://Microsoft/Utc': 'UTC',
+})
+
+TZ_CACHE_SIZE = 512
+
+# (start, start timezone name, end, end timezone name)
+EventTimes = Tuple[datetime, str, datetime, str]
+
+
+@lru_cache(maxsize=TZ_CACHE_SIZE)
+def get_timezone(name: str) -> pytz.BaseTzInfo:
+    """Get tz by IANA or windows zone name, raises pytz.UnknownTimeZoneError"""
+    return pytz.timezone(MS_TO_PYTZ_TZ_MAP.get(name, name))
+
+
+def windows_to_iana(name: str) -> str:
+    """Translate windows zone name to IANA one, unknown names are returned as is"""
+    return MS_TO_PYTZ_TZ_MAP.get(name, name)
+
+
+def check_timezones(names: Iterable[str]) -> None:
+    """Resolve all zones before parsing, so a page with unknown zone fails before any work is done"""
+    for name in set(names):
+        get_timezone(name)
+
+
+def _to_utc(value: datetime, tz_name: str) -> datetime:
+    if value.tzinfo is None:
+        value = get_timezone(tz_name).localize(value)
+    return value.astimezone(pytz.utc)
+
+
+def _parse_google_time(time: dict, tz_name: str) -> datetime:
+    """Google sends dateTime (RFC3339 with offset) for regular events and date for all-day ones"""
+    date_time = time.get('dateTime')
+    if date_time:
+        if date_time.endswith('Z'):
+            date_time = date_time[:-1] + '+00:00'
+        return _to_utc(datetime.fromisoformat(date_time), tz_name)
+    return _to_utc(datetime.fromisoformat(time.get('date')), tz_name)
+
+
+def parse_google_times(google_events: List[dict], default_tz: str) -> List[EventTimes]:
+    """Get UTC start/end and timezone names for a page of google events"""
+    zones = [
+        (google_event['start'].get('timeZone', default_tz), google_event['end'].get('timeZone', default_tz))
+        for google_event in google_events
+    ]
+    check_timezones(
+        tz_name
+        for google_event, event_zones in zip(google_events, zones)
+        for time, tz_name in zip((google_event['start'], google_event['end']), event_zones)
+        if not time.get('dateTime')
+    )
+    return [
+        (_parse_google_time(google_event['start'], start_tz), start_tz,
+         _parse_google_time(google_event['end'], end_tz), end_tz)
+        for google_event, (start_tz, end_tz) in zip(google_events, zones)
+    ]
+
+
+def _parse_outlook_time(time: dict) -> datetime:
+    """Graph sends naive dateTime with 7 digits of fraction in zone of timeZone field"""
+    # fromisoformat takes at most 6 digits of fraction
+    return _to_utc(datetime.fromisoformat(time['dateTime'][:26]), time.get('timeZone', 'UTC'))
+
+
+def parse_outlook_times(outlook_events: List[dict]) -> List[EventTimes]:
+    """Get UTC start/end and IANA timezone names for a page of outlook events"""
+    check_timezones(
+        time.get('timeZone', 'UTC')
+        for outlook_event in outlook_events
+        for time in (outlook_event['start'], outlook_event['end'])
+    )
+    return [
+        (_parse_outlook_time(outlook_event['start']), windows_to_iana(outlook_event['originalStartTimeZone']),
+         _parse_outlook_time(outlook_event['end']), windows_to_iana(outlook_event['originalEndTimeZone']))
+        for outlook_event in outlook_events
+    ]
@@ -0,0 +1,70 @@
+"""Relations of viewer to a page of events
+
+Serializers show viewer's attendance status, like, reminder and inviter for every event. ViewerContext loads
+each of these relations for all events of a page with one query, on first use of the relation.
+"""
+
+from typing import Iterable, Optional
+
+from events.models import Attendance, EventInvite, EventLike, Reminder
+
+CONTEXT_KEY = 'viewer_context'
+
+
+class ViewerContext:
+    """Viewer's relations to events, each relation is loaded for all events at once"""
+
+    def __init__(self, viewer, event_ids: Iterable[int]):
+        self.viewer = viewer
+        self.event_ids = set(event_ids)
+        self._relations = {}
+
+    def covers(self, event_id: int) -> bool:
+        return event_id in self.event_ids
+
+    def _load(self, name: str, loader) -> dict:
+        if name not in self._relations:
+            self._relations[name] = loader()
+        return self._relations[name]
+
+    def attendance_status(self, event_id: int) -> Optional[int]:
+        return self._load('statuses', lambda: dict(
+            Attendance.objects.filter(event_id__in=self.event_ids, user_id=self.viewer.id)
+            .values_list('event_id', 'status')
+        )).get(event_id)
+
+    def liked(self, event_id: int) -> bool:
+        return event_id in self._load('likes', lambda: set(
+            EventLike.objects.filter(event_id__in=self.event_ids, user_id=self.viewer.id)
+            .values_list('event_id', flat=True)
+        ))
+
+    def reminder(self, event_id: int) -> Optional[Reminder]:
+        return self._load('reminders', lambda: {
+            reminder.event_id: reminder
+            for reminder in Reminder.objects.filter(event_id__in=self.event_ids, user_id=self.viewer.id)
+        }).get(event_id)
+
+    def inviter(self, event_id: int):
+        invite = self._load('invites', lambda: {
+            invite.event_id: invite
+            for invite in EventInvite.objects.filter(
+                event_id__in=self.event_ids, invitee_id=self.viewer.id
+            ).select_related('inviter')
+        }).get(event_id)
+        return invite.inviter if invite else None
+
+
+def install(context: dict, events: Iterable) -> None:
+    """Put viewer context for events to serializer context, request of context is the viewer"""
+    request = context.get('request')
+    if request is not None:
+        context[CONTEXT_KEY] = ViewerContext(request.user, [event.pk for event in events])
+
+
+def for_event(context: dict, event) -> ViewerContext:
+    """Viewer context installed for page of event, or one for the single event which is kept for next fields"""
+    viewer_context = context.get(CONTEXT_KEY)
+    if viewer_context is None or not viewer_context.covers(event.pk):
+        viewer_context = context[CONTEXT_KEY] = ViewerContext(context['request'].user, [event.pk])
+    return viewer_context
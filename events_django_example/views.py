@@ -3,18 +3,18 @@ import json
 from django.http import HttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from .tasks import sync_google_events, sync_outlook_events
-from users.models import UserSocialAuth
+from .scheduler import schedule_sync
+from .subscriptions import resolve_social_ids
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def google_web_hook(request):
     channel_id = request.headers.get('X-Goog-Channel-ID')
-    if channel_id and UserSocialAuth.objects.filter(subscription_id=channel_id, provider='google-oauth2').exists():
-        social = UserSocialAuth.objects.get(subscription_id=channel_id, provider='google-oauth2')
-        sync_google_events.delay(social.pk)
-        return HttpResponse()
+    if channel_id:
+        social_id = resolve_social_ids('google-oauth2', [channel_id]).get(channel_id)
+        if social_id:
+            schedule_sync(social_id, 'google-oauth2')
     return HttpResponse()
 
 
@@ -27,10 +27,8 @@ def outlook_web_hook(request):
 
     notifications = json.loads(request.body)
 
-    for n in notifications['value']:
-        subscription_id = n['subscriptionId']
-        if UserSocialAuth.objects.filter(subscription_id=subscription_id, provider='microsoft-graph').exists():
-            social = UserSocialAuth.objects.get(subscription_id=subscription_id, provider='microsoft-graph')
-            sync_outlook_events.delay(social.pk)
+    subscription_ids = [n['subscriptionId'] for n in notifications['value']]
+    for social_id in set(resolve_social_ids('microsoft-graph', subscription_ids).values()):
+        schedule_sync(social_id, 'microsoft-graph')
 
     return HttpResponse()